@@ -0,0 +1,51 @@
+"""Added composite indexes to conversion history
+
+Revision ID: 40f8798a0727
+Revises: f7526ffc5d7d
+Create Date: 2026-10-18 18:40:12.504311
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '40f8798a0727'
+down_revision = 'f7526ffc5d7d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # history is always read for one user, newest first
+    op.create_index(
+        'ix_conversionhistory_user_timestamp',
+        'conversionhistory',
+        ['user_id', sa.text('timestamp DESC'), sa.text('id DESC')],
+        unique=False,
+    )
+    op.create_index(
+        'ix_conversionhistory_user_pair_timestamp',
+        'conversionhistory',
+        ['user_id', 'from_currency', 'to_currency', 'timestamp'],
+        unique=False,
+    )
+    # rows are inserted in time order so a BRIN index on timestamp stays
+    # tiny while still pruning date ranges
+    op.create_index(
+        'ix_conversionhistory_timestamp_brin',
+        'conversionhistory',
+        ['timestamp'],
+        unique=False,
+        postgresql_using='brin',
+    )
+    op.drop_index('ix_conversionhistory_to_currency', table_name='conversionhistory')
+    op.drop_index('ix_conversionhistory_from_currency', table_name='conversionhistory')
+
+
+def downgrade() -> None:
+    op.create_index('ix_conversionhistory_from_currency', 'conversionhistory', ['from_currency'], unique=False)
+    op.create_index('ix_conversionhistory_to_currency', 'conversionhistory', ['to_currency'], unique=False)
+    op.drop_index('ix_conversionhistory_timestamp_brin', table_name='conversionhistory')
+    op.drop_index('ix_conversionhistory_user_pair_timestamp', table_name='conversionhistory')
+    op.drop_index('ix_conversionhistory_user_timestamp', table_name='conversionhistory')
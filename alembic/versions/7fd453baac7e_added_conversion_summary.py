@@ -0,0 +1,53 @@
+"""Added conversion summary
+
+Revision ID: 7fd453baac7e
+Revises: e8d573b43060
+Create Date: 2026-10-18 19:48:02.530917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '7fd453baac7e'
+down_revision = 'e8d573b43060'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('conversionsummary',
+    sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('user_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('from_currency', sa.String(length=12), nullable=False),
+    sa.Column('to_currency', sa.String(length=12), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('total_amount', sa.Float(), nullable=False),
+    sa.Column('total_result', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'day', 'from_currency', 'to_currency', name='uq_conversionsummary_user_day_pair')
+    )
+    # summaries of the history written so far. From here on they are kept
+    # up to date as history is written
+    op.execute(
+        """
+        INSERT INTO conversionsummary (
+            id, user_id, from_currency, to_currency, day,
+            count, total_amount, total_result
+        )
+        SELECT gen_random_uuid(), user_id, from_currency, to_currency,
+            (timestamp AT TIME ZONE 'UTC')::date,
+            count(*), sum(amount), sum(result)
+        FROM conversionhistory
+        GROUP BY user_id, from_currency, to_currency,
+            (timestamp AT TIME ZONE 'UTC')::date
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('conversionsummary')
@@ -0,0 +1,32 @@
+"""Added rate snapshots
+
+Revision ID: cee9a4a29928
+Revises: 7fd453baac7e
+Create Date: 2026-10-18 20:31:12.604128
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'cee9a4a29928'
+down_revision = '7fd453baac7e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('ratesnapshot',
+    sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('base', sa.String(length=12), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('rates', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('base', 'day', name='uq_ratesnapshot_base_day')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('ratesnapshot')
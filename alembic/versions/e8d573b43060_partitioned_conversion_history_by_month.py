@@ -0,0 +1,149 @@
+"""Partitioned conversion history by month
+
+Revision ID: e8d573b43060
+Revises: 40f8798a0727
+Create Date: 2026-10-18 19:05:41.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8d573b43060'
+down_revision = '40f8798a0727'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = "id, from_currency, to_currency, amount, rate, result, user_id, timestamp"
+
+
+def create_indexes(table: str) -> None:
+    op.create_index(
+        'ix_conversionhistory_user_timestamp',
+        table,
+        ['user_id', sa.text('timestamp DESC'), sa.text('id DESC')],
+        unique=False,
+    )
+    op.create_index(
+        'ix_conversionhistory_user_pair_timestamp',
+        table,
+        ['user_id', 'from_currency', 'to_currency', 'timestamp'],
+        unique=False,
+    )
+    op.create_index(
+        'ix_conversionhistory_timestamp_brin',
+        table,
+        ['timestamp'],
+        unique=False,
+        postgresql_using='brin',
+    )
+
+
+def drop_indexes(table: str) -> None:
+    op.drop_index('ix_conversionhistory_timestamp_brin', table_name=table)
+    op.drop_index('ix_conversionhistory_user_pair_timestamp', table_name=table)
+    op.drop_index('ix_conversionhistory_user_timestamp', table_name=table)
+
+
+def upgrade() -> None:
+    # partition bounds are whole months in UTC
+    op.execute("SET LOCAL TIME ZONE 'UTC'")
+
+    op.rename_table('conversionhistory', 'conversionhistory_unpartitioned')
+    op.execute(
+        'ALTER TABLE conversionhistory_unpartitioned '
+        'RENAME CONSTRAINT conversionhistory_pkey TO conversionhistory_unpartitioned_pkey'
+    )
+    drop_indexes('conversionhistory_unpartitioned')
+
+    # the partition key has to be part of the primary key
+    op.execute(
+        """
+        CREATE TABLE conversionhistory (
+            id UUID NOT NULL,
+            from_currency VARCHAR(12) NOT NULL,
+            to_currency VARCHAR(12) NOT NULL,
+            amount FLOAT NOT NULL,
+            rate FLOAT NOT NULL,
+            result FLOAT NOT NULL,
+            user_id UUID NOT NULL REFERENCES "user" (id) ON DELETE CASCADE,
+            timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+        """
+    )
+    # catches anything outside the monthly partitions so inserts never fail
+    op.execute(
+        'CREATE TABLE conversionhistory_default PARTITION OF conversionhistory DEFAULT'
+    )
+    # a partition for every month with history, and the next three. The app
+    # keeps creating them ahead of time from then on
+    op.execute(
+        """
+        DO $$
+        DECLARE
+            month TIMESTAMP WITH TIME ZONE := date_trunc(
+                'month',
+                COALESCE(
+                    (SELECT min(timestamp) FROM conversionhistory_unpartitioned),
+                    now()
+                )
+            );
+        BEGIN
+            WHILE month <= date_trunc('month', now()) + INTERVAL '3 months' LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF conversionhistory '
+                    'FOR VALUES FROM (%L) TO (%L)',
+                    'conversionhistory_' || to_char(month, '"y"YYYY"m"MM'),
+                    month,
+                    month + INTERVAL '1 month'
+                );
+                month := month + INTERVAL '1 month';
+            END LOOP;
+        END $$
+        """
+    )
+    op.execute(
+        f"""
+        INSERT INTO conversionhistory ({COLUMNS})
+        SELECT id, from_currency, to_currency, amount, rate, result, user_id,
+            COALESCE(timestamp, now())
+        FROM conversionhistory_unpartitioned
+        """
+    )
+    op.drop_table('conversionhistory_unpartitioned')
+    create_indexes('conversionhistory')
+
+
+def downgrade() -> None:
+    op.rename_table('conversionhistory', 'conversionhistory_partitioned')
+    drop_indexes('conversionhistory_partitioned')
+    op.execute(
+        'ALTER TABLE conversionhistory_partitioned '
+        'RENAME CONSTRAINT conversionhistory_pkey TO conversionhistory_partitioned_pkey'
+    )
+
+    op.create_table('conversionhistory',
+    sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('from_currency', sa.String(length=12), nullable=False),
+    sa.Column('to_currency', sa.String(length=12), nullable=False),
+    sa.Column('amount', sa.Float(), nullable=False),
+    sa.Column('rate', sa.Float(), nullable=False),
+    sa.Column('result', sa.Float(), nullable=False),
+    sa.Column('user_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('timestamp', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute(
+        f"""
+        INSERT INTO conversionhistory ({COLUMNS})
+        SELECT {COLUMNS} FROM conversionhistory_partitioned
+        """
+    )
+    # drops every partition along with it
+    op.drop_table('conversionhistory_partitioned')
+    create_indexes('conversionhistory')
@@ -1,12 +1,15 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from redis import Redis
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from db.db import get_db
+from backend.rate_limit import RateLimit
+from db.db import get_async_db, get_async_read_db, get_redis
 
-from .models import User
 from .schema import (
     LoginSchema,
+    PrincipalSchema,
+    RefreshTokenSchema,
     SignupSchema,
     TokenSchema,
     UserSchema
@@ -17,31 +20,72 @@ from .services import UserService, reuseable_oauth
 router = APIRouter(prefix="/user")
 
 
-def get_user(
-    db: Session = Depends(get_db), token: str = Depends(reuseable_oauth)
-) -> User:
-    user = UserService(db).get_current_user(token)
+async def get_user(
+    db: AsyncSession = Depends(get_async_read_db),
+    primary_db: AsyncSession = Depends(get_async_db),
+    token: str = Depends(reuseable_oauth),
+) -> PrincipalSchema:
+    user = await UserService(db).get_current_user(token, primary_db=primary_db)
 
     return user
 
 
-@router.post("/signup", summary="Create a new user", response_model=UserSchema)
-async def signup(user: SignupSchema, db: Session = Depends(get_db)):
-    created_user = UserService(db).create_user(user)
+class UserRateLimit(RateLimit):
+    """
+    Rate limit counted per user rather than per IP address
+    """
+    async def __call__(
+        self,
+        request: Request,
+        redis: Redis = Depends(get_redis),
+        user: PrincipalSchema = Depends(get_user),
+    ) -> None:
+        if not user:
+            return await super().__call__(request, redis)
+
+        self.check(request, redis, f"user:{user.id}")
+
+
+@router.post(
+    "/signup",
+    summary="Create a new user",
+    response_model=UserSchema,
+    dependencies=[Depends(RateLimit("signup"))],
+)
+async def signup(user: SignupSchema, db: AsyncSession = Depends(get_async_db)):
+    created_user = await UserService(db).create_user(user)
     return created_user
 
 
-@router.post("/login", summary="Log in a user", response_model=TokenSchema)
-async def login(form: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+@router.post(
+    "/login",
+    summary="Log in a user",
+    response_model=TokenSchema,
+    dependencies=[Depends(RateLimit("login"))],
+)
+async def login(
+    form: OAuth2PasswordRequestForm = Depends(),
+    db: AsyncSession = Depends(get_async_db),
+):
     credentials = LoginSchema(email=form.username, password=form.password)
-    token = UserService(db).login(credentials)
+    token = await UserService(db).login(credentials)
     return token
 
 
+@router.post(
+    "/token/refresh",
+    summary="Exchange a refresh token for a new access and refresh token",
+    response_model=TokenSchema,
+    dependencies=[Depends(RateLimit("refresh"))],
+)
+async def refresh_token(body: RefreshTokenSchema, redis: Redis = Depends(get_redis)):
+    return UserService.refresh(body.refresh_token, redis)
+
+
 @router.get("/me", summary="Get details of logged in user", response_model=UserSchema)
 async def get_current_user(
-    db: Session = Depends(get_db), token: str = Depends(reuseable_oauth)
+    db: AsyncSession = Depends(get_async_read_db),
+    primary_db: AsyncSession = Depends(get_async_db),
+    token: str = Depends(reuseable_oauth),
 ):
-    user = UserService(db).get_current_user(token)
-    schema = UserSchema(**User.to_dict(user))
-    return schema
+    return await UserService(db).get_current_user(token, primary_db=primary_db)
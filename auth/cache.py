@@ -0,0 +1,123 @@
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from uuid import UUID
+
+from redis import Redis
+from redis.exceptions import RedisError
+from sqlalchemy import event
+
+from backend.settings import redis_key, settings
+from db.db import redis_client
+
+from .models import User
+from .schema import PrincipalSchema
+
+
+class CachedPrincipal(NamedTuple):
+    principal: PrincipalSchema
+    valid_until: float
+
+
+class PrincipalCache:
+    """
+    Users that tokens were recently checked for, so an authenticated
+    request doesn't look its user up in Postgres every time.
+
+    Entries are kept in the worker by the hash of the token, for up to
+    PRINCIPAL_CACHE_TTL seconds and never past the expiry of the token,
+    so a hit costs a hash and a dict lookup. With PRINCIPAL_CACHE_REDIS on,
+    they are shared with other workers by user id. Changes to a user drop
+    it from this worker and from Redis at once, while other workers may
+    keep their copy until its TTL runs out.
+    """
+    REDIS_KEY = redis_key("principal:{}")
+
+    def __init__(self) -> None:
+        self.entries: "OrderedDict[str, CachedPrincipal]" = OrderedDict()
+
+    @staticmethod
+    def token_key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    @property
+    def redis(self) -> Optional[Redis]:
+        return redis_client if settings.PRINCIPAL_CACHE_REDIS else None
+
+    def get(self, token: str) -> Optional[PrincipalSchema]:
+        key = self.token_key(token)
+        entry = self.entries.get(key)
+
+        if entry is None:
+            return None
+
+        if entry.valid_until <= time.monotonic():
+            del self.entries[key]
+            return None
+
+        self.entries.move_to_end(key)
+        return entry.principal
+
+    def put(self, token: str, principal: PrincipalSchema, expires_in: float) -> None:
+        """
+        Caches the principal of a token that expires in `expires_in` seconds
+        """
+        ttl = min(settings.PRINCIPAL_CACHE_TTL, expires_in)
+        if ttl <= 0:
+            return
+
+        key = self.token_key(token)
+        self.entries[key] = CachedPrincipal(principal, time.monotonic() + ttl)
+        self.entries.move_to_end(key)
+
+        if len(self.entries) > settings.PRINCIPAL_CACHE_SIZE:
+            self.entries.popitem(last=False)
+
+    def get_shared(self, user_id: UUID) -> Optional[PrincipalSchema]:
+        if self.redis is None:
+            return None
+
+        try:
+            cached = self.redis.get(self.REDIS_KEY.format(user_id))
+        except RedisError:
+            logging.exception("Could not read a cached principal")
+            return None
+
+        return PrincipalSchema.parse_raw(cached) if cached else None
+
+    def share(self, principal: PrincipalSchema) -> None:
+        if self.redis is None:
+            return
+
+        try:
+            self.redis.setex(
+                self.REDIS_KEY.format(principal.id),
+                settings.PRINCIPAL_CACHE_TTL,
+                principal.json(),
+            )
+        except RedisError:
+            logging.exception("Could not cache a principal")
+
+    def invalidate(self, user_id: UUID) -> None:
+        for key, entry in list(self.entries.items()):
+            if entry.principal.id == user_id:
+                del self.entries[key]
+
+        if self.redis is None:
+            return
+
+        try:
+            self.redis.delete(self.REDIS_KEY.format(user_id))
+        except RedisError:
+            logging.exception("Could not invalidate a cached principal")
+
+
+principal_cache = PrincipalCache()
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def invalidate_principal(mapper, connection, target: User) -> None:
+    principal_cache.invalidate(target.id)
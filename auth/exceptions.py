@@ -27,3 +27,15 @@ UserDoesNotExist = HTTPException(
     status_code=status.HTTP_404_NOT_FOUND,
     detail="Could not find user",
 )
+
+RefreshTokenRevoked = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Refresh token has already been used",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+PasswordHasherBusy = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="Too many logins at once, try again shortly",
+    headers={"Retry-After": "1"},
+)
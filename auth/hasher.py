@@ -0,0 +1,65 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, Tuple
+
+from backend.settings import settings
+
+from . import exceptions
+
+
+class PasswordHasher:
+    """
+    Hashes and verifies passwords in a small pool of threads so bcrypt
+    never holds up the event loop (it releases the GIL while it works).
+    Up to PASSWORD_HASHER_QUEUE jobs may wait for a thread. Past that,
+    signups and logins get a 503 straight away rather than queueing for
+    longer than a client would wait.
+    """
+    def __init__(self) -> None:
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.pending = 0
+
+    @property
+    def capacity(self) -> int:
+        return settings.PASSWORD_HASHER_THREADS + settings.PASSWORD_HASHER_QUEUE
+
+    async def run(self, function: Callable[..., Any], *args: Any) -> Any:
+        if self.pending >= self.capacity:
+            raise exceptions.PasswordHasherBusy
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=settings.PASSWORD_HASHER_THREADS,
+                thread_name_prefix="password-hasher",
+            )
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, function, *args
+            )
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self.run(settings.PASSWORD_HASHER.hash, password)
+
+    async def verify_and_update(
+        self, password: str, hashed_password: str
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        Checks a password against its hash. When the hash was made with
+        settings that are out of date, a new hash of the password comes
+        back with it
+        """
+        return await self.run(
+            settings.PASSWORD_HASHER.verify_and_update, password, hashed_password
+        )
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+password_hasher = PasswordHasher()
@@ -1,5 +1,6 @@
 from datetime import datetime
 from typing import Optional
+from uuid import UUID
 
 from db.schema import BaseSchema
 
@@ -33,6 +34,13 @@ class UserSchema(BaseSchema):
     created_at: datetime
 
 
+class PrincipalSchema(UserSchema):
+    """
+    The user a request is authenticated as
+    """
+    id: UUID
+
+
 class TokenSchema(BaseSchema):
     """
     Handles token for authentication and authorization
@@ -41,9 +49,15 @@ class TokenSchema(BaseSchema):
     refresh_token: str
 
 
+class RefreshTokenSchema(BaseSchema):
+    refresh_token: str
+
+
 class AuthSchema(BaseSchema):
     """
     Handles encoded information for user and expiry date for tokens
     """
     expiry: datetime
-    data: UserSchema
+    data: PrincipalSchema
+    type: str = "access"
+    jti: Optional[str]
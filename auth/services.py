@@ -1,17 +1,30 @@
 import logging
 from datetime import datetime, timedelta
 from typing import Any, Dict, Optional
+from uuid import uuid4
 
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt
 from pydantic import ValidationError
+from redis import Redis
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from backend.services import BaseService
-from backend.settings import settings
+from backend.services import AsyncBaseService
+from backend.settings import redis_key, settings
 
 from . import exceptions
+from .cache import principal_cache
+from .hasher import password_hasher
 from .models import User
-from .schema import AuthSchema, LoginSchema, SignupSchema, TokenSchema, UserSchema
+from .schema import (
+    AuthSchema,
+    LoginSchema,
+    PrincipalSchema,
+    SignupSchema,
+    TokenSchema,
+    UserSchema,
+)
 
 # for authentication that works seamlessly with OpenAPI
 reuseable_oauth = OAuth2PasswordBearer(
@@ -20,29 +33,21 @@ reuseable_oauth = OAuth2PasswordBearer(
 )
 
 
-def hash_password(password: str) -> str:
-    """Creates a hash of the password"""
-    hashed_password = settings.PASSWORD_HASHER.hash(password)
-    return hashed_password
-
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Checks if a password corresponds to a hash"""
-    password_is_verified = settings.PASSWORD_HASHER.verify(
-        plain_password, hashed_password
-    )
-
-    return bool(password_is_verified)
-
-
-def create_auth_token(payload: Dict[str, Any], expiry: int) -> str:
+def create_auth_token(
+    payload: Dict[str, Any], expiry: int, token_type: str = "access"
+) -> str:
     """
     This handles the encoding of user information into a token
     that can be used. It is generic so as to accomodate access and
-    refresh token.
+    refresh token. Every token gets an id of its own so it can be revoked.
     """
     expiry_delta = datetime.now() + timedelta(seconds=expiry)
-    data_to_encode = {"expiry": str(expiry_delta), "data": payload}
+    data_to_encode = {
+        "expiry": str(expiry_delta),
+        "data": payload,
+        "type": token_type,
+        "jti": uuid4().hex,
+    }
     encoded_data: str = jwt.encode(
         data_to_encode, settings.SECRET_KEY, settings.JWT_ALGORITHM
     )
@@ -50,85 +55,166 @@ def create_auth_token(payload: Dict[str, Any], expiry: int) -> str:
     return encoded_data
 
 
-class UserService(BaseService):
+def create_token_pair(user: Dict[str, Any]) -> TokenSchema:
+    return TokenSchema(
+        access_token=create_auth_token(
+            user,
+            settings.ACCESS_TOKEN_EXPIRY_TIME
+        ),
+        refresh_token=create_auth_token(
+            user,
+            settings.REFRESH_TOKEN_EXPIRY_TIME,
+            token_type="refresh",
+        ),
+    )
+
+
+def decode_auth_token(token: str, token_type: str = "access") -> AuthSchema:
+    """
+    Checks the signature, expiry and type of a token and returns
+    what it holds
+    """
+    try:
+        payload = jwt.decode(
+            token,
+            settings.SECRET_KEY,
+            algorithms=[settings.JWT_ALGORITHM]
+        )
+        logging.info(payload)
+        expiry = datetime.fromisoformat(payload['expiry'])
+
+        # if the expiry date is in the pas
+        if expiry < datetime.now():
+            raise exceptions.TokenExpired
+
+        token_data = AuthSchema(
+            expiry=expiry,
+            data=payload['data'],
+            # tokens from before there were refresh tokens are access tokens
+            type=payload.get('type', "access"),
+            jti=payload.get('jti'),
+        )
+    except (jwt.JWTError, ValidationError, KeyError, ValueError):
+        raise exceptions.UnvalidatedCredentials
+
+    if token_data.type != token_type:
+        raise exceptions.UnvalidatedCredentials
+
+    return token_data
+
+
+class UserService(AsyncBaseService):
     """
     Core functionality for user-related tasks.
     """
-    def create_user(self, user: SignupSchema) -> User:
+    # refresh tokens that have been exchanged, by their id
+    REVOKED_TOKEN_REDIS_KEY = redis_key("revoked:{}")
+
+    async def get_user_by_email(self, email: str) -> Optional[User]:
+        result = await self.db.execute(select(User).where(User.email == email))
+        return result.scalars().first()
+
+    async def create_user(self, user: SignupSchema) -> User:
         """
         Creates a user from signup details
         """
-        user_from_db = self.db.query(User).filter(
-            User.email == user.email
-        ).first()
+        user_from_db = await self.get_user_by_email(user.email)
 
         if user_from_db:
             raise exceptions.UserExist
 
-        user.password = hash_password(user.password)
+        user.password = await password_hasher.hash(user.password)
         user_to_save = User(**user.to_dict())
-        self.save(user_to_save)
-        result = UserSchema(**User.to_dict(user_to_save))
+        await self.save(user_to_save)
+        result = UserSchema.from_orm(user_to_save)
         return result
 
-    def login(self, credentials: LoginSchema) -> TokenSchema:
+    async def login(self, credentials: LoginSchema) -> TokenSchema:
         """
         Confirms a user and grants an access and refresh token if
         credentials are valid.
         """
-        user_from_db: Optional[User] = self.db.query(User).filter(
-            User.email == credentials.email
-        ).first()
+        user_from_db = await self.get_user_by_email(credentials.email)
 
         if not user_from_db:
             raise exceptions.InvalidCredentials
 
-        if not verify_password(credentials.password, user_from_db.password):
+        is_verified, new_hash = await password_hasher.verify_and_update(
+            credentials.password, user_from_db.password
+        )
+        if not is_verified:
             raise exceptions.InvalidCredentials
 
-        user = User.to_dict(user_from_db)
-        # we don'w want the password hash to be visible in
-        # the token information
-        user.pop("password")
-        token = TokenSchema(
-            access_token=create_auth_token(
-                user,
-                settings.ACCESS_TOKEN_EXPIRY_TIME
-            ),
-            refresh_token=create_auth_token(
-                user,
-                settings.REFRESH_TOKEN_EXPIRY_TIME
-            ),
-        )
+        # the hash was made with older settings, such as fewer rounds
+        if new_hash:
+            user_from_db.password = new_hash
+            await self.db.commit()
+
+        # only the public details, the password hash stays out of the token
+        user = PrincipalSchema.from_orm(user_from_db).to_dict()
+        token = create_token_pair(user)
         return token
 
-    def get_current_user(self, token: str) -> User:
+    @classmethod
+    def refresh(cls, refresh_token: str, redis_client: Redis) -> TokenSchema:
         """
-        Returns a user from a token
+        Exchanges a refresh token for a new access and refresh token. It
+        takes the signature of the token and one Redis command, with no
+        password or database involved. A refresh token can be exchanged
+        once, so a stolen one stops working as soon as either party uses it.
         """
-        try:
-            payload = jwt.decode(
-                token,
-                settings.SECRET_KEY,
-                algorithms=[settings.JWT_ALGORITHM]
-            )
-            logging.info(payload)
-            token_data = AuthSchema(
-                expiry=datetime.fromisoformat(payload['expiry']),
-                data=payload['data']
-            )
-
-            # if the expiry date is in the pas
-            if token_data.expiry < datetime.now():
-                raise exceptions.TokenExpired
-        except (jwt.JWTError, ValidationError):
+        token_data = decode_auth_token(refresh_token, token_type="refresh")
+        if not token_data.jti:
             raise exceptions.UnvalidatedCredentials
 
-        user_from_db: Optional[User] = self.db.query(User).filter(
-            User.email == token_data.data.email
-        ).first()
+        # revoked for as long as it would have been valid
+        expires_in = (token_data.expiry - datetime.now()).total_seconds()
+        is_first_use = redis_client.set(
+            cls.REVOKED_TOKEN_REDIS_KEY.format(token_data.jti),
+            1,
+            nx=True,
+            ex=max(int(expires_in) + 1, 1),
+        )
+        if not is_first_use:
+            raise exceptions.RefreshTokenRevoked
 
-        if user_from_db is None:
-            raise exceptions.UnvalidatedCredentials
+        return create_token_pair(token_data.data.to_dict())
+
+    async def get_current_user(
+        self, token: str, primary_db: Optional[AsyncSession] = None
+    ) -> PrincipalSchema:
+        """
+        Returns the user a token belongs to. Recently seen tokens are
+        answered from the principal cache without decoding them again
+        or going to the database.
+
+        When the service reads from a replica, pass the primary as
+        `primary_db` so users the replica hasn't caught up with yet, such
+        as ones who just signed up, are looked up there instead
+        """
+        principal = principal_cache.get(token)
+        if principal is not None:
+            return principal
+
+        token_data = decode_auth_token(token)
+
+        principal = principal_cache.get_shared(token_data.data.id)
+
+        if principal is None:
+            user_from_db = await self.get_user_by_email(token_data.data.email)
+
+            if user_from_db is None and primary_db is not None:
+                user_from_db = await UserService(primary_db).get_user_by_email(
+                    token_data.data.email
+                )
+
+            if user_from_db is None:
+                raise exceptions.UnvalidatedCredentials
+
+            principal = PrincipalSchema.from_orm(user_from_db)
+            principal_cache.share(principal)
+
+        expires_in = (token_data.expiry - datetime.now()).total_seconds()
+        principal_cache.put(token, principal, expires_in)
 
-        return user_from_db
+        return principal
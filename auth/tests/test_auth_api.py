@@ -1,5 +1,14 @@
+import time
+from datetime import datetime
+from unittest.mock import patch
+from uuid import uuid4
+
+from sqlalchemy import event
 from starlette.testclient import TestClient
-from auth.services import create_auth_token
+from auth.cache import PrincipalCache, invalidate_principal, principal_cache
+from auth.models import User
+from auth.schema import PrincipalSchema
+from auth.services import UserService, create_auth_token
 
 from conftest import temp_db
 from main import app
@@ -168,4 +177,183 @@ def test_user_with_expired_token_cannot_view_details():
         }
     )
     assert response.status_code == 401
-    assert response.json()['detail'] == "Token expired"
\ No newline at end of file
+    assert response.json()['detail'] == "Token expired"
+
+@temp_db
+def test_repeated_requests_with_a_token_see_the_same_user():
+    response = client.post(
+        "/api/v1/user/signup",
+        json=user
+    )
+
+    assert response.status_code == 200
+
+    response = client.post(
+        "/api/v1/user/login",
+        data=credentials
+    )
+
+    assert response.status_code == 200
+
+    access_token = response.json()['access_token']
+    details = []
+    for _ in range(2):
+        response = client.get(
+            "/api/v1/user/me",
+            headers={
+                'Authorization': f"Bearer {access_token}"
+            }
+        )
+        assert response.status_code == 200
+        details.append(response.json())
+
+    assert details[0] == details[1]
+    assert details[0]['email'] == user['email']
+
+@temp_db
+def test_repeated_requests_with_a_token_are_answered_from_the_cache():
+    response = client.post(
+        "/api/v1/user/signup",
+        json=user
+    )
+
+    assert response.status_code == 200
+
+    response = client.post(
+        "/api/v1/user/login",
+        data=credentials
+    )
+
+    assert response.status_code == 200
+
+    headers = {
+        'Authorization': f"Bearer {response.json()['access_token']}"
+    }
+    response = client.get("/api/v1/user/me", headers=headers)
+
+    assert response.status_code == 200
+
+    # the user was cached by the first request, so the database isn't asked
+    with patch.object(
+        UserService,
+        "get_user_by_email",
+        side_effect=AssertionError("the user was looked up again"),
+    ):
+        response = client.get("/api/v1/user/me", headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()['email'] == user['email']
+
+
+def cached_principal():
+    return PrincipalSchema(
+        id=uuid4(),
+        email=user["email"],
+        first_name=user["first_name"],
+        last_name=user["last_name"],
+        created_at=datetime.utcnow(),
+    )
+
+
+def test_updating_a_user_drops_their_cached_principal():
+    principal = cached_principal()
+    principal_cache.put("token-of-an-updated-user", principal, 60)
+
+    assert principal_cache.get("token-of-an-updated-user") == principal
+    assert event.contains(User, "after_update", invalidate_principal)
+
+    invalidate_principal(None, None, User(id=principal.id))
+
+    assert principal_cache.get("token-of-an-updated-user") is None
+
+
+def test_principals_are_not_cached_past_the_expiry_of_their_token():
+    cache = PrincipalCache()
+    principal = cached_principal()
+
+    cache.put("token-about-to-expire", principal, expires_in=0.05)
+    assert cache.get("token-about-to-expire") == principal
+
+    time.sleep(0.1)
+    assert cache.get("token-about-to-expire") is None
+
+    cache.put("expired-token", principal, expires_in=0)
+    assert cache.get("expired-token") is None
+
+@temp_db
+def test_refresh_token_can_be_exchanged_once_for_new_tokens():
+    response = client.post(
+        "/api/v1/user/signup",
+        json=user
+    )
+
+    assert response.status_code == 200
+
+    response = client.post(
+        "/api/v1/user/login",
+        data=credentials
+    )
+
+    assert response.status_code == 200
+    tokens = response.json()
+
+    response = client.post(
+        "/api/v1/user/token/refresh",
+        json={"refresh_token": tokens['refresh_token']}
+    )
+
+    assert response.status_code == 200
+    assert "access_token" in response.json()
+    assert "refresh_token" in response.json()
+
+    response = client.get(
+        "/api/v1/user/me",
+        headers={
+            'Authorization': f"Bearer {response.json()['access_token']}"
+        }
+    )
+
+    assert response.status_code == 200
+    assert response.json()['email'] == user['email']
+
+    response = client.post(
+        "/api/v1/user/token/refresh",
+        json={"refresh_token": tokens['refresh_token']}
+    )
+
+    assert response.status_code == 401
+    assert response.json()['detail'] == "Refresh token has already been used"
+
+    response = client.post(
+        "/api/v1/user/token/refresh",
+        json={"refresh_token": tokens['access_token']}
+    )
+
+    assert response.status_code == 403
+
+
+@temp_db
+def test_logins_past_the_rate_limit_are_turned_away():
+    response = client.post(
+        "/api/v1/user/signup",
+        json=user
+    )
+
+    assert response.status_code == 200
+
+    for _ in range(10):
+        response = client.post(
+            "/api/v1/user/login",
+            data=credentials
+        )
+
+        assert response.status_code == 200
+        assert "X-RateLimit-Remaining" in response.headers
+
+    response = client.post(
+        "/api/v1/user/login",
+        data=credentials
+    )
+
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
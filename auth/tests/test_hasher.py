@@ -0,0 +1,43 @@
+import asyncio
+import threading
+
+import pytest
+
+from auth import exceptions
+from auth.hasher import PasswordHasher
+from backend.settings import settings
+
+
+def test_hashing_past_capacity_is_turned_away(monkeypatch):
+    monkeypatch.setattr(settings, "PASSWORD_HASHER_THREADS", 1)
+    monkeypatch.setattr(settings, "PASSWORD_HASHER_QUEUE", 1)
+    hasher = PasswordHasher()
+    # holds the one thread, so the second job has to wait for it
+    release = threading.Event()
+
+    async def storm():
+        held = [
+            asyncio.ensure_future(hasher.run(release.wait, 5)) for _ in range(2)
+        ]
+        await asyncio.sleep(0)
+        assert hasher.pending == 2
+
+        with pytest.raises(type(exceptions.PasswordHasherBusy)) as error:
+            await hasher.run(str.upper, "turned away")
+
+        release.set()
+        await asyncio.gather(*held)
+        # once the backlog clears there is room again
+        return error.value, await hasher.run(str.upper, "let in")
+
+    try:
+        error, result = asyncio.run(storm())
+    finally:
+        release.set()
+        hasher.shutdown()
+
+    assert error is exceptions.PasswordHasherBusy
+    assert error.status_code == 503
+    assert "Retry-After" in error.headers
+    assert result == "LET IN"
+    assert hasher.pending == 0
@@ -0,0 +1,221 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, Set
+
+from redis import Redis
+from redis.client import Pipeline
+from redis.exceptions import LockError
+
+from backend.settings import settings
+
+
+class CachedValue(NamedTuple):
+    """
+    A cached value along with the time it stops being fresh. Stale values
+    are still served until Redis expires them, while a refresh happens in
+    the background
+    """
+    data: Any
+    expires_at: float
+    version: int = 0
+
+    @property
+    def expires_in(self) -> float:
+        return self.expires_at - time.time()
+
+    @property
+    def is_stale(self) -> bool:
+        return self.expires_in <= 0
+
+
+# kept next to the key it counts writes to
+VERSION_REDIS_KEY = "{}:version"
+
+
+def write_cache(
+    redis_client: Redis,
+    key: str,
+    data: Any,
+    expiry: int = settings.CURRENCY_CACHE_EXPIRY_TIME,
+    stale_expiry: int = settings.CURRENCY_CACHE_STALE_TIME,
+    pipeline: Optional[Pipeline] = None,
+) -> None:
+    """
+    Caches `data` as fresh for `expiry` seconds. It is kept for
+    `stale_expiry` seconds in total so there is something to serve
+    while the upstream is down. Every write bumps the version of the
+    key so local copies in other workers know to reload it.
+
+    Pass a pipeline to write along with other commands, in which case
+    executing it is left to the caller.
+    """
+    envelope = {"expires_at": time.time() + expiry, "data": data}
+    commands = pipeline if pipeline is not None else redis_client.pipeline()
+    commands.setex(key, stale_expiry, json.dumps(envelope))
+    commands.incr(VERSION_REDIS_KEY.format(key))
+
+    if pipeline is None:
+        commands.execute()
+
+    local_cache.invalidate(key)
+
+
+def read_cache(redis_client: Redis, key: str) -> Optional[CachedValue]:
+    cached, version = (
+        redis_client.pipeline()
+        .get(key)
+        .get(VERSION_REDIS_KEY.format(key))
+        .execute()
+    )
+
+    if not cached:
+        return None
+
+    return CachedValue(**json.loads(cached), version=int(version or 0))
+
+
+class LocalEntry(NamedTuple):
+    value: CachedValue
+    checked_at: float
+
+
+class LocalCache:
+    """
+    Per-process copy of values cached in Redis. An entry is served without
+    touching Redis for LOCAL_CACHE_TTL seconds. After that only the version
+    of the key is read, and the entry is kept as long as nothing has been
+    written to the key since.
+    """
+    def __init__(self) -> None:
+        self.entries: Dict[str, LocalEntry] = {}
+
+    def get(self, key: str, redis_client: Redis) -> Optional[CachedValue]:
+        entry = self.entries.get(key)
+        now = time.monotonic()
+
+        if entry is not None:
+            if now - entry.checked_at < settings.LOCAL_CACHE_TTL:
+                return entry.value
+
+            version = redis_client.get(VERSION_REDIS_KEY.format(key))
+            if int(version or 0) == entry.value.version:
+                self.entries[key] = entry._replace(checked_at=now)
+                return entry.value
+
+        value = read_cache(redis_client, key)
+
+        if value is None:
+            self.entries.pop(key, None)
+        else:
+            self.entries[key] = LocalEntry(value=value, checked_at=now)
+
+        return value
+
+    def invalidate(self, key: str) -> None:
+        self.entries.pop(key, None)
+
+
+local_cache = LocalCache()
+
+
+class SingleFlight:
+    """
+    Makes sure a cache key is refilled by one caller at a time. Callers in
+    the same worker share the refill that is already in flight, while
+    workers coordinate through a short Redis lock so only one of them goes
+    upstream and the others wait for the value it writes.
+    """
+    LOCK_REDIS_KEY = "{}:lock"
+
+    def __init__(self) -> None:
+        self.calls: Dict[str, asyncio.Task] = {}
+        self.background: Set[asyncio.Task] = set()
+
+    async def load(
+        self,
+        key: str,
+        redis_client: Redis,
+        read: Callable[[], Optional[Any]],
+        fill: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """
+        Returns what `read` finds in the cache, or the result of `fill`
+        when the cache is empty
+        """
+        value = read()
+        if value is not None:
+            return value
+
+        call = self.calls.get(key)
+        if call is None or call.get_loop() is not asyncio.get_running_loop():
+            call = asyncio.ensure_future(
+                self.load_across_workers(key, redis_client, read, fill)
+            )
+            self.calls[key] = call
+            call.add_done_callback(lambda _: self.calls.pop(key, None))
+
+        # a caller giving up must not cancel the refill the others wait on
+        return await asyncio.shield(call)
+
+    async def load_across_workers(
+        self,
+        key: str,
+        redis_client: Redis,
+        read: Callable[[], Optional[Any]],
+        fill: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        lock = redis_client.lock(
+            self.LOCK_REDIS_KEY.format(key),
+            timeout=settings.SINGLE_FLIGHT_LOCK_TIMEOUT,
+        )
+        deadline = time.monotonic() + settings.SINGLE_FLIGHT_LOCK_TIMEOUT
+
+        while True:
+            if lock.acquire(blocking=False):
+                try:
+                    # the previous holder may have just filled it
+                    value = read()
+                    if value is not None:
+                        return value
+
+                    return await fill()
+                finally:
+                    try:
+                        lock.release()
+                    except LockError:
+                        # it expired while we were filling
+                        pass
+
+            await asyncio.sleep(settings.SINGLE_FLIGHT_POLL_INTERVAL)
+
+            value = read()
+            if value is not None:
+                return value
+
+            if time.monotonic() >= deadline:
+                # whoever holds the lock is stuck, don't wait on them forever
+                return await fill()
+
+    def load_in_background(
+        self,
+        key: str,
+        redis_client: Redis,
+        read: Callable[[], Optional[Any]],
+        fill: Callable[[], Awaitable[Any]],
+    ) -> None:
+        """
+        Refills a key without making the caller wait. Failures are only
+        logged since the caller already has a value to serve
+        """
+        async def refill() -> None:
+            try:
+                await self.load(key, redis_client, read, fill)
+            except Exception:
+                logging.exception("Could not refresh %s", key)
+
+        task = asyncio.ensure_future(refill())
+        # the event loop only keeps weak references to tasks
+        self.background.add(task)
+        task.add_done_callback(self.background.discard)
@@ -0,0 +1,141 @@
+import time
+from typing import Any, Dict
+
+from redis import Redis
+
+from backend.settings import redis_key, settings
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for an upstream host. The state lives in Redis so every
+    worker stops calling a failing host as soon as one of them trips it.
+
+    - closed: calls go through while the error rate in the current window
+      stays under CIRCUIT_BREAKER_ERROR_RATE. Calls slower than
+      CIRCUIT_BREAKER_SLOW_CALL_TIME count as errors.
+    - open: calls are refused for CIRCUIT_BREAKER_OPEN_TIME seconds.
+    - half open: a single probe call is let through. It closes the circuit
+      if it succeeds and opens it again if it fails. A host nobody calls
+      closes on its own CIRCUIT_BREAKER_WINDOW after it was let out of open.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    OPEN_REDIS_KEY = redis_key("circuit:{}:open")
+    TRIPPED_REDIS_KEY = redis_key("circuit:{}:tripped")
+    PROBE_REDIS_KEY = redis_key("circuit:{}:probe")
+    WINDOW_REDIS_KEY = redis_key("circuit:{}:window:{}")
+
+    def __init__(self, name: str, redis_client: Redis) -> None:
+        self.name = name
+        self.redis_client = redis_client
+        self.probing = False
+
+    @property
+    def window_key(self) -> str:
+        window = int(time.time() // settings.CIRCUIT_BREAKER_WINDOW)
+        return self.WINDOW_REDIS_KEY.format(self.name, window)
+
+    def state(self) -> str:
+        is_open, is_tripped = (
+            self.redis_client.pipeline()
+            .exists(self.OPEN_REDIS_KEY.format(self.name))
+            .exists(self.TRIPPED_REDIS_KEY.format(self.name))
+            .execute()
+        )
+
+        if is_open:
+            return self.OPEN
+        if is_tripped:
+            return self.HALF_OPEN
+        return self.CLOSED
+
+    def allow_request(self) -> bool:
+        state = self.state()
+
+        if state == self.CLOSED:
+            return True
+
+        if state == self.HALF_OPEN and not self.probing:
+            # only one worker gets to probe a recovering host
+            self.probing = bool(
+                self.redis_client.set(
+                    self.PROBE_REDIS_KEY.format(self.name),
+                    1,
+                    nx=True,
+                    ex=settings.CIRCUIT_BREAKER_PROBE_TIMEOUT,
+                )
+            )
+            return self.probing
+
+        return False
+
+    def trip(self) -> None:
+        (
+            self.redis_client.pipeline()
+            .setex(
+                self.OPEN_REDIS_KEY.format(self.name),
+                settings.CIRCUIT_BREAKER_OPEN_TIME,
+                1,
+            )
+            .setex(
+                self.TRIPPED_REDIS_KEY.format(self.name),
+                settings.CIRCUIT_BREAKER_OPEN_TIME + settings.CIRCUIT_BREAKER_WINDOW,
+                1,
+            )
+            .delete(self.PROBE_REDIS_KEY.format(self.name), self.window_key)
+            .execute()
+        )
+        self.probing = False
+
+    def reset(self) -> None:
+        self.redis_client.delete(
+            self.TRIPPED_REDIS_KEY.format(self.name),
+            self.PROBE_REDIS_KEY.format(self.name),
+            self.window_key,
+        )
+        self.probing = False
+
+    def record(self, failed: bool) -> None:
+        calls, failures, _ = (
+            self.redis_client.pipeline()
+            .hincrby(self.window_key, "calls", 1)
+            .hincrby(self.window_key, "failures", int(failed))
+            .expire(self.window_key, settings.CIRCUIT_BREAKER_WINDOW * 2)
+            .execute()
+        )
+
+        if (
+            calls >= settings.CIRCUIT_BREAKER_MIN_CALLS
+            and failures / calls >= settings.CIRCUIT_BREAKER_ERROR_RATE
+        ):
+            self.trip()
+
+    def record_success(self, latency: float) -> None:
+        failed = latency > settings.CIRCUIT_BREAKER_SLOW_CALL_TIME
+
+        if self.probing:
+            self.trip() if failed else self.reset()
+            return
+
+        self.record(failed)
+
+    def record_failure(self) -> None:
+        if self.probing:
+            self.trip()
+            return
+
+        self.record(True)
+
+    def health(self) -> Dict[str, Any]:
+        window: Dict[bytes, bytes] = self.redis_client.hgetall(self.window_key)
+        calls = int(window.get(b"calls", 0))
+        failures = int(window.get(b"failures", 0))
+
+        return {
+            "state": self.state(),
+            "calls": calls,
+            "error_rate": failures / calls if calls else 0.0,
+        }
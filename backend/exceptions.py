@@ -0,0 +1,8 @@
+from fastapi import HTTPException, status
+
+
+RateLimitExceeded = lambda headers: HTTPException(
+    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+    detail="Too many requests, slow down",
+    headers=headers,
+)
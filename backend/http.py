@@ -0,0 +1,62 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import httpx
+
+from backend.settings import settings
+
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """
+    Creates a pooled client with keep-alive and explicit timeouts
+    for calls to upstream services
+    """
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(
+            settings.HTTP_READ_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT
+        ),
+        limits=httpx.Limits(
+            max_connections=settings.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+async def start_http_client() -> None:
+    global _client, _client_loop
+
+    _client = create_http_client()
+    _client_loop = asyncio.get_running_loop()
+
+
+async def close_http_client() -> None:
+    global _client, _client_loop
+
+    if _client is not None:
+        await _client.aclose()
+
+    _client = None
+    _client_loop = None
+
+
+@asynccontextmanager
+async def get_http_client() -> AsyncIterator[httpx.AsyncClient]:
+    """
+    Yields the client shared by the worker, which lives from startup to
+    shutdown. Pooled connections belong to the event loop that opened
+    them, so loops that didn't go through startup (such as the test
+    client's) get a client of their own that is closed once they are done
+    with it.
+    """
+    if _client is not None and _client_loop is asyncio.get_running_loop():
+        yield _client
+        return
+
+    async with create_http_client() as client:
+        yield client
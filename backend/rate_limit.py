@@ -0,0 +1,186 @@
+import logging
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import Depends, Request
+from redis import Redis
+from redis.commands.core import Script
+from redis.exceptions import RedisError
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from backend.settings import redis_key, settings
+from db.db import get_redis
+
+from .exceptions import RateLimitExceeded
+
+
+# Takes a token from a bucket that holds up to ARGV[1] tokens and gets
+# ARGV[2] back every second, using the clock of Redis so every worker
+# agrees on it. Returns whether a token was taken, how many are left and
+# how many seconds until the next one
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * refill_rate)
+
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = (1 - tokens) / refill_rate
+end
+
+redis.call("HSET", KEYS[1], "tokens", tokens, "updated_at", now)
+redis.call("EXPIRE", KEYS[1], math.ceil(capacity / refill_rate) + 1)
+
+return {allowed, tostring(tokens), tostring(retry_after)}
+"""
+
+
+def client_address(request: Request) -> str:
+    """
+    Address of the client making the request. Behind trusted proxies it is
+    the last address in X-Forwarded-For that isn't one of them, as the
+    client can put anything before it
+    """
+    host = request.client.host if request.client else ""
+    proxies = settings.TRUSTED_PROXIES
+    if "*" not in proxies and host not in proxies:
+        return host
+
+    forwarded = request.headers.get("X-Forwarded-For", "").split(",")
+    for address in reversed(forwarded):
+        address = address.strip()
+        if address and address not in proxies:
+            return address
+
+    return host
+
+
+class RateLimit:
+    """
+    Dependency limiting how often a client may call a route, with a token
+    bucket in Redis so the limit holds across workers. Limits are set
+    per route in RATE_LIMITS. This counts per IP address (see
+    client_address for clients behind a proxy); see auth.api.UserRateLimit
+    for counting per user.
+
+    A client that has been turned away is remembered in the worker until
+    it may try again, so a client hammering a route is rejected without
+    touching Redis. If Redis is down requests are let through. The check
+    runs on the event loop, as a dependency run in a thread would share
+    blocked_until with the other threads.
+    """
+    REDIS_KEY = redis_key("ratelimit:{}:{}")
+    # clients turned away by this worker and when they may try again
+    blocked_until: Dict[str, float] = {}
+    # sent by its hash once Redis has seen it
+    token_bucket: Optional[Script] = None
+
+    def __init__(self, route: str) -> None:
+        self.route = route
+        self.capacity, self.period = settings.RATE_LIMITS[route]
+        self.refill_rate = self.capacity / self.period
+
+    async def __call__(
+        self, request: Request, redis: Redis = Depends(get_redis)
+    ) -> None:
+        self.check(request, redis, client_address(request))
+
+    def check(self, request: Request, redis_client: Redis, client: str) -> None:
+        if not settings.RATE_LIMIT_ENABLED:
+            return
+
+        key = self.REDIS_KEY.format(self.route, client)
+        now = time.monotonic()
+
+        blocked_until = self.blocked_until.get(key)
+        if blocked_until is not None:
+            if now < blocked_until:
+                raise RateLimitExceeded(self.headers(0, blocked_until - now))
+            self.blocked_until.pop(key, None)
+
+        if RateLimit.token_bucket is None:
+            RateLimit.token_bucket = redis_client.register_script(
+                TOKEN_BUCKET_SCRIPT
+            )
+
+        try:
+            allowed, tokens, retry_after = self.token_bucket(
+                keys=[key],
+                args=[self.capacity, self.refill_rate],
+                client=redis_client,
+            )
+        except RedisError:
+            logging.exception("Could not check the rate limit of %s", key)
+            return
+
+        tokens, retry_after = float(tokens), float(retry_after)
+
+        if not allowed:
+            if len(self.blocked_until) >= settings.RATE_LIMIT_BLOCKED_SIZE:
+                # forget the clients that never came back
+                for blocked_key, until in list(self.blocked_until.items()):
+                    if until <= now:
+                        self.blocked_until.pop(blocked_key, None)
+
+            self.blocked_until[key] = now + retry_after
+            raise RateLimitExceeded(self.headers(tokens, retry_after))
+
+        # picked up by RateLimitHeadersMiddleware on the way out
+        request.state.rate_limit_headers = self.headers(tokens, 0)
+
+    def headers(self, tokens: float, retry_after: float) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.capacity),
+            "X-RateLimit-Remaining": str(int(tokens)),
+            # seconds until the bucket is full again
+            "X-RateLimit-Reset": str(
+                math.ceil((self.capacity - tokens) / self.refill_rate)
+            ),
+        }
+        if retry_after:
+            headers["Retry-After"] = str(math.ceil(retry_after))
+
+        return headers
+
+
+class RateLimitHeadersMiddleware:
+    """
+    Adds the X-RateLimit-* headers of the request to its response. It
+    works for every kind of response, including ones routes return
+    themselves, which dependencies can't add headers to.
+    """
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = scope.get("state", {}).get("rate_limit_headers")
+                if headers:
+                    raw_headers: List[Tuple[bytes, bytes]] = list(
+                        message.get("headers", [])
+                    )
+                    raw_headers.extend(
+                        (name.lower().encode(), value.encode())
+                        for name, value in headers.items()
+                    )
+                    message["headers"] = raw_headers
+
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
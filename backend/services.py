@@ -1,5 +1,6 @@
 from typing import Type
 
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from db.base import Base
@@ -16,3 +17,16 @@ class BaseService:
         self.db.add(model)
         self.db.commit()
         self.db.refresh(model)
+
+
+class AsyncBaseService:
+    """
+    Base class for services that work with the database from the event loop
+    """
+    def __init__(self, db: AsyncSession) -> None:
+        self.db = db
+
+    async def save(self, model: Type[Base]) -> None:
+        self.db.add(model)
+        await self.db.commit()
+        await self.db.refresh(model)
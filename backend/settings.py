@@ -1,3 +1,4 @@
+from enum import Enum
 from os import environ
 
 from passlib.context import CryptContext
@@ -7,6 +8,25 @@ def get_env_with_context(value: str, default=None, context="API") -> str:
     return environ.get(f"{context}_{value}")
 
 
+def get_async_db_url(url: str) -> str:
+    """
+    The same database as `url` through the asyncpg driver
+    """
+    return "postgresql+asyncpg://" + url.split("://", 1)[1]
+
+
+class RatePolicy(str, Enum):
+    """
+    Decides where the rate engine gets the rate of a pair from
+    """
+    # always work out the cross rate from the pivot table
+    PIVOT = "pivot"
+    # always use the rate table of the currency being converted from
+    DIRECT = "direct"
+    # use the direct table when it is already cached, otherwise triangulate
+    PREFER_DIRECT = "prefer_direct"
+
+
 class Settings:
     APP_TITLE = "Currency Converter API"
     SECRET_KEY = environ.get("SECRET_KEY")
@@ -20,18 +40,163 @@ class Settings:
         f"postgresql+psycopg2://"
         f"{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_DB}",
     ).replace("postgres://", "postgresql://")
+    ASYNC_DB_URL = environ.get("ASYNC_DATABASE_URL", get_async_db_url(DB_URL))
+    # history and user lookups are read from the replica when one is set
+    DB_REPLICA_URL = environ.get("DATABASE_REPLICA_URL")
+    ASYNC_DB_REPLICA_URL = (
+        get_async_db_url(DB_REPLICA_URL) if DB_REPLICA_URL else None
+    )
+    # seconds reads stay on the primary after the replica couldn't be reached
+    DB_REPLICA_RETRY_INTERVAL = 30
+    # connections each worker keeps open per engine, and how many more it
+    # may open under load. A request waits up to DB_POOL_TIMEOUT seconds
+    # for a connection, and connections are replaced after DB_POOL_RECYCLE
+    # seconds. Pre-ping checks a connection is alive before handing it out
+    DB_POOL_SIZE = int(environ.get("DB_POOL_SIZE", 10))
+    DB_MAX_OVERFLOW = int(environ.get("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT = float(environ.get("DB_POOL_TIMEOUT", 5))
+    DB_POOL_RECYCLE = int(environ.get("DB_POOL_RECYCLE", 60 * 30))
+    DB_POOL_PRE_PING = environ.get("DB_POOL_PRE_PING", "1") == "1"
     TEST_DB = get_env_with_context("TEST_DB", context="POSTGRES")
     TEST_DB_URL = (
         f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{TEST_DB}"
     )
     ACCESS_TOKEN_EXPIRY_TIME = 60 * 30
     REFRESH_TOKEN_EXPIRY_TIME = 60 * 24 * 7
-    PASSWORD_HASHER = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    # authenticated users are cached by token for up to PRINCIPAL_CACHE_TTL
+    # seconds (never past the expiry of the token), PRINCIPAL_CACHE_SIZE of
+    # them per worker. PRINCIPAL_CACHE_REDIS shares them between workers
+    PRINCIPAL_CACHE_TTL = int(environ.get("PRINCIPAL_CACHE_TTL", 60))
+    PRINCIPAL_CACHE_SIZE = 10000
+    PRINCIPAL_CACHE_REDIS = environ.get("PRINCIPAL_CACHE_REDIS", "0") == "1"
+    # cost of new hashes. Hashes made with other rounds are redone on login
+    BCRYPT_ROUNDS = int(environ.get("BCRYPT_ROUNDS", 12))
+    PASSWORD_HASHER = CryptContext(
+        schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS
+    )
+    # threads hashing passwords in each worker, and how many more hashes may
+    # wait for one before signups and logins are turned away
+    PASSWORD_HASHER_THREADS = int(environ.get("PASSWORD_HASHER_THREADS", 2))
+    PASSWORD_HASHER_QUEUE = int(environ.get("PASSWORD_HASHER_QUEUE", 16))
     JWT_ALGORITHM = "HS256"
     REDIS_URL = environ.get("REDIS_URL")
+    # the tests use this database on the server of REDIS_URL, whatever
+    # database the URL names, and empty it after every test
+    REDIS_TEST_DB = int(environ.get("REDIS_TEST_DB", 1))
+    # every worker shares one pool of up to REDIS_MAX_CONNECTIONS. Commands
+    # give up after REDIS_SOCKET_TIMEOUT seconds, and connections idle for
+    # REDIS_HEALTH_CHECK_INTERVAL seconds are checked before being reused
+    REDIS_MAX_CONNECTIONS = int(environ.get("REDIS_MAX_CONNECTIONS", 50))
+    REDIS_SOCKET_TIMEOUT = float(environ.get("REDIS_SOCKET_TIMEOUT", 2))
+    REDIS_SOCKET_CONNECT_TIMEOUT = float(environ.get("REDIS_SOCKET_CONNECT_TIMEOUT", 2))
+    REDIS_HEALTH_CHECK_INTERVAL = 30
+    # every key starts with the prefix and the version. Bump the version
+    # when what is stored changes shape so old keys are left to expire
+    REDIS_KEY_PREFIX = environ.get("REDIS_KEY_PREFIX", "cc")
+    REDIS_KEY_VERSION = 1
+    # cached currencies and rates are fresh for CURRENCY_CACHE_EXPIRY_TIME and
+    # are served stale for up to CURRENCY_CACHE_STALE_TIME if upstream is down
     CURRENCY_CACHE_EXPIRY_TIME = 60 * 60 * 24
+    CURRENCY_CACHE_STALE_TIME = 60 * 60 * 24 * 7
+    # the refresher wakes up every CACHE_REFRESH_INTERVAL give or take
+    # CACHE_REFRESH_JITTER of it, and refreshes whatever expires within
+    # CACHE_REFRESH_AHEAD. In seconds
+    CACHE_REFRESH_INTERVAL = 60 * 10
+    CACHE_REFRESH_JITTER = 0.2
+    CACHE_REFRESH_AHEAD = 60 * 60
+    # seconds a worker trusts its own copy of a cached value before asking
+    # Redis whether it changed
+    LOCAL_CACHE_TTL = 30
+    # every cross rate is worked out from the rate table of this currency
+    RATE_PIVOT_CURRENCY = environ.get("RATE_PIVOT_CURRENCY", "usd")
+    # one of "pivot", "direct" or "prefer_direct". An unknown policy stops
+    # the app from starting
+    RATE_POLICY = RatePolicy(environ.get("RATE_POLICY", "pivot"))
+    # past rate snapshots never change, so each worker keeps up to this many
+    # of them in memory
+    RATE_SNAPSHOT_CACHE_SIZE = 366
     PAGE_SIZE = 50
+    MAX_PAGE_SIZE = int(environ.get("MAX_PAGE_SIZE", PAGE_SIZE))
+    # rows fetched from the server-side cursor and written out at a time
+    # when exporting history
+    HISTORY_EXPORT_CHUNK_SIZE = 1000
+    # conversions are written to history in the background, in inserts of up
+    # to HISTORY_FLUSH_SIZE rows at least every HISTORY_FLUSH_INTERVAL seconds.
+    # Once HISTORY_QUEUE_LIMIT are waiting, requests write their own. Reads
+    # of history may be that far behind, as they may be on the replica
+    HISTORY_WRITE_BEHIND = environ.get("HISTORY_WRITE_BEHIND", "1") == "1"
+    HISTORY_FLUSH_SIZE = 500
+    HISTORY_FLUSH_INTERVAL = 1.0
+    HISTORY_QUEUE_LIMIT = 100000
+    # history is partitioned by month. Partitions are created
+    # HISTORY_PARTITIONS_AHEAD months in advance, and the ones older than
+    # HISTORY_RETENTION_MONTHS are dropped, or only detached if
+    # HISTORY_RETENTION_DROP is off. 0 keeps history forever
+    HISTORY_PARTITIONS_AHEAD = int(environ.get("HISTORY_PARTITIONS_AHEAD", 3))
+    HISTORY_RETENTION_MONTHS = int(environ.get("HISTORY_RETENTION_MONTHS", 0))
+    HISTORY_RETENTION_DROP = environ.get("HISTORY_RETENTION_DROP", "1") == "1"
+    # seconds between runs of partition maintenance
+    HISTORY_PARTITION_MAINTENANCE_INTERVAL = 60 * 60 * 6
+    # most conversions a single batch request may carry
+    BATCH_CONVERSION_LIMIT = int(environ.get("BATCH_CONVERSION_LIMIT", 5000))
+    # timeouts are in seconds
+    HTTP_CONNECT_TIMEOUT = float(environ.get("HTTP_CONNECT_TIMEOUT", 3))
+    HTTP_READ_TIMEOUT = float(environ.get("HTTP_READ_TIMEOUT", 5))
+    HTTP_MAX_CONNECTIONS = int(environ.get("HTTP_MAX_CONNECTIONS", 100))
+    HTTP_MAX_KEEPALIVE_CONNECTIONS = int(
+        environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20)
+    )
+    HTTP_KEEPALIVE_EXPIRY = 30
+    # race the next mirror when the current one hasn't answered in time
+    UPSTREAM_HEDGING = environ.get("UPSTREAM_HEDGING", "1") == "1"
+    UPSTREAM_HEDGE_DELAY = float(environ.get("UPSTREAM_HEDGE_DELAY", 0.3))
+    # weight of the newest sample in the moving average of mirror latencies
+    UPSTREAM_LATENCY_SMOOTHING = 0.2
+    # an upstream host is cut off when at least ERROR_RATE of the calls in a
+    # WINDOW (and no fewer than MIN_CALLS) fail or are slower than
+    # SLOW_CALL_TIME. It is probed again after OPEN_TIME. Times are in seconds
+    CIRCUIT_BREAKER_WINDOW = 60
+    CIRCUIT_BREAKER_MIN_CALLS = 5
+    CIRCUIT_BREAKER_ERROR_RATE = 0.5
+    CIRCUIT_BREAKER_SLOW_CALL_TIME = 2.0
+    CIRCUIT_BREAKER_OPEN_TIME = 30
+    CIRCUIT_BREAKER_PROBE_TIMEOUT = 10
+    # how long a worker may hold the lock while refilling a cache key, and
+    # how often the workers waiting on it look for the new value. In seconds
+    SINGLE_FLIGHT_LOCK_TIMEOUT = 10
+    SINGLE_FLIGHT_POLL_INTERVAL = 0.05
+    # requests allowed per route as (requests, per seconds). Routes that
+    # need a user count per user, the others per IP address. Each worker
+    # remembers up to RATE_LIMIT_BLOCKED_SIZE clients it turned away
+    RATE_LIMIT_ENABLED = environ.get("RATE_LIMIT_ENABLED", "1") == "1"
+    RATE_LIMIT_BLOCKED_SIZE = 10000
+    RATE_LIMITS = {
+        "signup": (5, 60),
+        "login": (10, 60),
+        "refresh": (10, 60),
+        "currencies": (120, 60),
+        "convert": (60, 60),
+        "convert_batch": (10, 60),
+        "history": (120, 60),
+        "history_summary": (60, 60),
+        "history_export": (5, 60),
+        "internal_stats": (30, 60),
+    }
+    # addresses of the proxies in front of the app, whose X-Forwarded-For
+    # is trusted to tell the address of the client. "*" trusts whatever
+    # connects, for a single proxy of unknown address like the Heroku router
+    TRUSTED_PROXIES = environ.get("TRUSTED_PROXIES", "").split()
+    # the routes showing the state of the mirrors and the history writer
+    # are only served when this is on. They are not for the public
+    INTERNAL_STATS_ENABLED = environ.get("INTERNAL_STATS_ENABLED", "0") == "1"
     ALLOWED_CLIENTS = environ.get("ALLOWED_CLIENTS").split()
 
 
 settings = Settings()
+
+
+def redis_key(key: str) -> str:
+    """
+    `key` in the namespace of this version of the app
+    """
+    return f"{settings.REDIS_KEY_PREFIX}:v{settings.REDIS_KEY_VERSION}:{key}"
@@ -0,0 +1,131 @@
+import asyncio
+
+from fakeredis import FakeRedis
+
+from backend.cache import LocalCache, SingleFlight, read_cache, write_cache
+from backend.settings import settings
+from converter.services import ConverterService, cache_refills
+
+KEY = "test:rates:usd"
+RATES = {"ngn": 750.0}
+
+
+def reader(redis_client):
+    def read():
+        cached = read_cache(redis_client, KEY)
+        return cached.data if cached else None
+
+    return read
+
+
+def filler(redis_client, calls, rates=RATES):
+    async def fill():
+        calls.append(1)
+        # long enough for every caller to be waiting on it
+        await asyncio.sleep(0.05)
+        write_cache(redis_client, KEY, rates)
+        return rates
+
+    return fill
+
+
+def test_concurrent_callers_share_one_refill():
+    redis_client = FakeRedis()
+    flight = SingleFlight()
+    calls = []
+
+    async def callers():
+        return await asyncio.gather(
+            *(
+                flight.load(
+                    KEY, redis_client, reader(redis_client), filler(redis_client, calls)
+                )
+                for _ in range(50)
+            )
+        )
+
+    results = asyncio.run(callers())
+
+    assert len(calls) == 1
+    assert results == [RATES] * 50
+    assert not flight.calls
+
+
+def test_workers_wait_on_the_refill_of_the_one_holding_the_lock(monkeypatch):
+    monkeypatch.setattr(settings, "SINGLE_FLIGHT_POLL_INTERVAL", 0.01)
+    redis_client = FakeRedis()
+    calls = []
+
+    async def workers():
+        # each SingleFlight stands in for a worker of its own
+        return await asyncio.gather(
+            *(
+                SingleFlight().load(
+                    KEY, redis_client, reader(redis_client), filler(redis_client, calls)
+                )
+                for _ in range(5)
+            )
+        )
+
+    results = asyncio.run(workers())
+
+    assert len(calls) == 1
+    assert results == [RATES] * 5
+
+
+def test_cached_values_are_not_refilled():
+    redis_client = FakeRedis()
+    write_cache(redis_client, KEY, RATES)
+    calls = []
+
+    result = asyncio.run(
+        SingleFlight().load(
+            KEY, redis_client, reader(redis_client), filler(redis_client, calls)
+        )
+    )
+
+    assert result == RATES
+    assert not calls
+
+
+def test_stale_values_are_served_while_being_refreshed():
+    redis_client = FakeRedis()
+    write_cache(redis_client, KEY, RATES, expiry=-1)
+    fresh_rates = {"ngn": 800.0}
+    calls = []
+
+    async def get_twice():
+        first = await ConverterService.get_cached(
+            KEY, redis_client, filler(redis_client, calls, fresh_rates)
+        )
+        await asyncio.gather(*cache_refills.background)
+        second = await ConverterService.get_cached(
+            KEY, redis_client, filler(redis_client, calls, fresh_rates)
+        )
+        return first, second
+
+    first, second = asyncio.run(get_twice())
+
+    assert first == RATES
+    assert second == fresh_rates
+    assert len(calls) == 1
+    assert not read_cache(redis_client, KEY).is_stale
+
+
+def test_local_cache_serves_its_copy_until_the_key_is_written(monkeypatch):
+    redis_client = FakeRedis()
+    cache = LocalCache()
+    write_cache(redis_client, KEY, RATES)
+
+    assert cache.get(KEY, redis_client).data == RATES
+
+    # another worker writes to Redis. Within the TTL the copy is served
+    redis_client.set(KEY, b"not json")
+    assert cache.get(KEY, redis_client).data == RATES
+
+    # past it only the version is read, and it hasn't changed
+    monkeypatch.setattr(settings, "LOCAL_CACHE_TTL", 0)
+    assert cache.get(KEY, redis_client).data == RATES
+
+    write_cache(redis_client, KEY, {"ngn": 800.0})
+    assert cache.get(KEY, redis_client).data == {"ngn": 800.0}
@@ -0,0 +1,118 @@
+from fakeredis import FakeRedis
+
+from backend.circuit_breaker import CircuitBreaker
+from backend.settings import settings
+
+HOST = "mirror.example"
+
+
+def open_time_runs_out(redis_client):
+    redis_client.delete(CircuitBreaker.OPEN_REDIS_KEY.format(HOST))
+
+
+def trip(breaker):
+    for _ in range(settings.CIRCUIT_BREAKER_MIN_CALLS):
+        breaker.record_failure()
+
+
+def test_circuit_stays_closed_under_the_minimum_number_of_calls():
+    breaker = CircuitBreaker(HOST, FakeRedis())
+
+    for _ in range(settings.CIRCUIT_BREAKER_MIN_CALLS - 1):
+        breaker.record_failure()
+
+    assert breaker.state() == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+
+
+def test_circuit_opens_once_the_error_rate_is_reached():
+    breaker = CircuitBreaker(HOST, FakeRedis())
+
+    breaker.record_success(0.1)
+    assert breaker.state() == CircuitBreaker.CLOSED
+
+    trip(breaker)
+
+    assert breaker.state() == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+
+
+def test_slow_calls_count_as_failures():
+    breaker = CircuitBreaker(HOST, FakeRedis())
+
+    for _ in range(settings.CIRCUIT_BREAKER_MIN_CALLS):
+        breaker.record_success(settings.CIRCUIT_BREAKER_SLOW_CALL_TIME + 1)
+
+    assert breaker.state() == CircuitBreaker.OPEN
+
+
+def test_circuit_is_half_open_after_the_open_time():
+    redis_client = FakeRedis()
+    breaker = CircuitBreaker(HOST, redis_client)
+    trip(breaker)
+
+    open_time_runs_out(redis_client)
+
+    assert breaker.state() == CircuitBreaker.HALF_OPEN
+
+
+def test_only_one_worker_probes_a_half_open_circuit():
+    redis_client = FakeRedis()
+    breaker = CircuitBreaker(HOST, redis_client)
+    other_worker = CircuitBreaker(HOST, redis_client)
+    trip(breaker)
+    open_time_runs_out(redis_client)
+
+    assert breaker.allow_request()
+    assert not other_worker.allow_request()
+    # the probe doesn't let more of its own calls through either
+    assert not breaker.allow_request()
+
+
+def test_successful_probe_closes_the_circuit():
+    redis_client = FakeRedis()
+    breaker = CircuitBreaker(HOST, redis_client)
+    trip(breaker)
+    open_time_runs_out(redis_client)
+
+    assert breaker.allow_request()
+    breaker.record_success(0.1)
+
+    assert breaker.state() == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+    assert CircuitBreaker(HOST, redis_client).allow_request()
+
+
+def test_failed_probe_opens_the_circuit_again():
+    redis_client = FakeRedis()
+    breaker = CircuitBreaker(HOST, redis_client)
+    trip(breaker)
+    open_time_runs_out(redis_client)
+
+    assert breaker.allow_request()
+    breaker.record_failure()
+
+    assert breaker.state() == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+
+    # the next probe is open to any worker
+    open_time_runs_out(redis_client)
+    assert CircuitBreaker(HOST, redis_client).allow_request()
+
+
+def test_a_circuit_nobody_probes_closes_on_its_own():
+    redis_client = FakeRedis()
+    breaker = CircuitBreaker(HOST, redis_client)
+    trip(breaker)
+
+    ttl = redis_client.ttl(CircuitBreaker.TRIPPED_REDIS_KEY.format(HOST))
+    assert settings.CIRCUIT_BREAKER_OPEN_TIME < ttl <= (
+        settings.CIRCUIT_BREAKER_OPEN_TIME + settings.CIRCUIT_BREAKER_WINDOW
+    )
+
+    open_time_runs_out(redis_client)
+    assert breaker.state() == CircuitBreaker.HALF_OPEN
+
+    # the window runs out with no probe
+    redis_client.delete(CircuitBreaker.TRIPPED_REDIS_KEY.format(HOST))
+    assert breaker.state() == CircuitBreaker.CLOSED
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+from fakeredis import FakeRedis
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from backend.rate_limit import RateLimit
+from backend.settings import settings
+
+
+@pytest.fixture
+def limit(monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setitem(settings.RATE_LIMITS, "signup", (1, 60))
+    monkeypatch.setattr(RateLimit, "blocked_until", {})
+    return RateLimit("signup")
+
+
+def request_from(host, headers=()):
+    return Request(
+        {
+            "type": "http",
+            "method": "POST",
+            "path": "/api/v1/user/signup",
+            "client": (host, 50000),
+            "headers": [(name.encode(), value.encode()) for name, value in headers],
+        }
+    )
+
+
+def test_a_blocked_client_is_turned_away_until_it_may_try_again(limit):
+    redis_client = FakeRedis()
+
+    asyncio.run(limit(request_from("10.0.0.1"), redis_client))
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(limit(request_from("10.0.0.1"), redis_client))
+
+    assert error.value.status_code == 429
+    assert len(RateLimit.blocked_until) == 1
+
+    # the block has passed, so retries arriving together all reach Redis
+    key = next(iter(RateLimit.blocked_until))
+    RateLimit.blocked_until[key] = 0
+    redis_client.delete(key)
+
+    async def retries():
+        return await asyncio.gather(
+            *(limit(request_from("10.0.0.1"), redis_client) for _ in range(3)),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(retries())
+
+    assert results[0] is None
+    assert all(
+        isinstance(result, HTTPException) and result.status_code == 429
+        for result in results[1:]
+    )
+
+
+def test_clients_at_different_addresses_have_buckets_of_their_own(limit):
+    redis_client = FakeRedis()
+
+    asyncio.run(limit(request_from("10.0.0.1"), redis_client))
+    asyncio.run(limit(request_from("10.0.0.2"), redis_client))
+
+    with pytest.raises(HTTPException):
+        asyncio.run(limit(request_from("10.0.0.2"), redis_client))
+
+
+def test_clients_behind_a_trusted_proxy_are_told_apart(limit, monkeypatch):
+    monkeypatch.setattr(settings, "TRUSTED_PROXIES", ["10.1.0.1"])
+    redis_client = FakeRedis()
+
+    # the router appends the address it saw. What comes before it is the
+    # client's to make up, so it doesn't get a client a new bucket
+    for forwarded in ("203.0.113.7", "198.51.100.1, 203.0.113.8"):
+        asyncio.run(
+            limit(
+                request_from("10.1.0.1", [("x-forwarded-for", forwarded)]),
+                redis_client,
+            )
+        )
+
+    with pytest.raises(HTTPException):
+        asyncio.run(
+            limit(
+                request_from(
+                    "10.1.0.1", [("x-forwarded-for", "198.51.100.2, 203.0.113.8")]
+                ),
+                redis_client,
+            )
+        )
+
+    # X-Forwarded-For from anything but the proxy is ignored
+    asyncio.run(
+        limit(
+            request_from("10.0.0.9", [("x-forwarded-for", "203.0.113.7")]),
+            redis_client,
+        )
+    )
@@ -0,0 +1,49 @@
+-- Plans and timings of the history queries the API makes, against the
+-- table seeded by seed_history.sql. See that file for how to run it.
+
+\set ON_ERROR_STOP on
+\pset pager off
+
+-- the heaviest user in the seeded table
+SELECT md5('user1')::uuid AS user_id \gset
+
+\echo '== first page of history'
+EXPLAIN (ANALYZE, BUFFERS)
+SELECT * FROM conversionhistory
+WHERE user_id = :'user_id'
+ORDER BY timestamp DESC, id DESC
+LIMIT 51;
+
+\echo '== page of history after a cursor'
+EXPLAIN (ANALYZE, BUFFERS)
+SELECT * FROM conversionhistory
+WHERE user_id = :'user_id'
+  AND (timestamp, id) < (timestamptz '2023-01-01', md5('cursor')::uuid)
+ORDER BY timestamp DESC, id DESC
+LIMIT 51;
+
+\echo '== page of history filtered by pair'
+EXPLAIN (ANALYZE, BUFFERS)
+SELECT * FROM conversionhistory
+WHERE user_id = :'user_id' AND from_currency = 'usd' AND to_currency = 'ngn'
+ORDER BY timestamp DESC, id DESC
+LIMIT 51;
+
+\echo '== export of a date range'
+EXPLAIN (ANALYZE, BUFFERS)
+SELECT timestamp, from_currency, to_currency, amount, rate, result
+FROM conversionhistory
+WHERE user_id = :'user_id'
+  AND timestamp >= timestamptz '2023-03-01' AND timestamp < timestamptz '2023-04-01'
+ORDER BY timestamp, id;
+
+\echo '== every conversion in a day'
+EXPLAIN (ANALYZE, BUFFERS)
+SELECT count(*) FROM conversionhistory
+WHERE timestamp >= timestamptz '2023-06-01' AND timestamp < timestamptz '2023-06-02';
+
+\echo '== index sizes'
+SELECT indexrelname AS index, pg_size_pretty(pg_relation_size(indexrelid)) AS size
+FROM pg_stat_user_indexes
+WHERE relname = 'conversionhistory'
+ORDER BY indexrelname;
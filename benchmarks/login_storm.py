@@ -0,0 +1,116 @@
+"""
+Measures the latency of conversions on a running server, first on their
+own and then while the server is hit by a burst of logins. It shows how
+much password hashing holds up everything else on a worker.
+
+    RATE_LIMIT_ENABLED=0 uvicorn main:app --workers 1 &
+    python benchmarks/login_storm.py --url http://localhost:8000
+
+It makes far more conversions and logins than RATE_LIMITS lets a user
+make in a minute, so the server has to run with rate limiting off.
+
+With bcrypt on the event loop every login stalls the worker, so p99 of
+conversions during the storm grows with the number of logins. With
+hashing off the loop it should stay close to the baseline, and logins
+past PASSWORD_HASHER_THREADS + PASSWORD_HASHER_QUEUE are turned away
+with a 503.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List
+
+import httpx
+
+
+CONVERSION = {"from_currency": "usd", "to_currency": "ngn", "amount": 30}
+
+
+async def measure_conversions(
+    client: httpx.AsyncClient, headers: Dict[str, str], count: int, concurrency: int
+) -> List[float]:
+    limit = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def convert() -> None:
+        async with limit:
+            started = time.perf_counter()
+            response = await client.post(
+                "/currencies/convert", json=CONVERSION, headers=headers
+            )
+            latencies.append(time.perf_counter() - started)
+            if response.status_code == 429:
+                raise SystemExit(
+                    "Conversions were rate limited. Run the server with "
+                    "RATE_LIMIT_ENABLED=0"
+                )
+            response.raise_for_status()
+
+    await asyncio.gather(*(convert() for _ in range(count)))
+    return latencies
+
+
+async def login(client: httpx.AsyncClient, credentials: Dict[str, str]) -> int:
+    response = await client.post("/user/login", data=credentials)
+    return response.status_code
+
+
+def report(name: str, latencies: List[float]) -> None:
+    percentiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{name:>10}: p50 {percentiles[49] * 1000:7.1f}ms"
+        f"  p99 {percentiles[98] * 1000:7.1f}ms"
+        f"  max {max(latencies) * 1000:7.1f}ms"
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    async with httpx.AsyncClient(
+        base_url=f"{args.url.rstrip('/')}/api/v1", timeout=120
+    ) as client:
+        email = f"storm-{uuid.uuid4().hex[:12]}@example.com"
+        password = "login-storm-password"
+        response = await client.post(
+            "/user/signup",
+            json={"email": email, "first_name": "Storm", "password": password},
+        )
+        response.raise_for_status()
+
+        credentials = {"username": email, "password": password}
+        response = await client.post("/user/login", data=credentials)
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        # fills the rate cache so upstream isn't part of the numbers
+        await measure_conversions(client, headers, 10, 1)
+
+        baseline = await measure_conversions(
+            client, headers, args.conversions, args.concurrency
+        )
+
+        storm = asyncio.ensure_future(
+            asyncio.gather(*(login(client, credentials) for _ in range(args.logins)))
+        )
+        during_storm = await measure_conversions(
+            client, headers, args.conversions, args.concurrency
+        )
+        statuses = Counter(await storm)
+
+    report("baseline", baseline)
+    report("storm", during_storm)
+    print(
+        f"{'logins':>10}: "
+        + ", ".join(f"{count} x {status}" for status, count in sorted(statuses.items()))
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--conversions", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    asyncio.run(main(parser.parse_args()))
@@ -1,18 +1,22 @@
 import pytest
-from redis import Redis
+from redis import ConnectionPool, Redis
+from redis.connection import parse_url
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from sqlalchemy_utils import (
     create_database,
     database_exists,
     drop_database
 )
 
+from backend.rate_limit import RateLimit
 from db.base import Base
-from db.db import get_db, get_redis
+from db.db import get_async_db, get_async_read_db, get_redis
 from main import app
 
-from backend.settings import settings
+from backend.settings import get_async_db_url, settings
 
 @pytest.fixture(scope="function")
 def SessionLocal():
@@ -33,33 +37,55 @@ def SessionLocal():
     # Drop the test database
     drop_database(settings.TEST_DB_URL)
 
+
+@pytest.fixture(scope="function")
+def AsyncSessionLocal(SessionLocal):
+    # the test client runs every request in a loop of its own, and pooled
+    # asyncpg connections can't move between loops
+    engine = create_async_engine(
+        get_async_db_url(settings.TEST_DB_URL), poolclass=NullPool
+    )
+
+    yield sessionmaker(
+        bind=engine,
+        class_=AsyncSession,
+        autoflush=False,
+        expire_on_commit=False,
+    )
+
+
 def temp_db(f):
-    def func(SessionLocal, *args, **kwargs):
+    def func(SessionLocal, AsyncSessionLocal, *args, **kwargs):
         #Sessionmaker instance to connect to test DB
         #  (SessionLocal)From fixture
 
-        def override_get_db():
-            try:
-                db = SessionLocal()
+        async def override_get_async_db():
+            async with AsyncSessionLocal() as db:
                 yield db
-            finally:
-                db.close()
         
+        # a database of its own so tests don't clash with a running app,
+        # emptied once the test is done. A database in the URL would win
+        # over one passed to Redis.from_url, so it is replaced here
+        redis_options = parse_url(settings.REDIS_URL)
+        assert redis_options.get("db", 0) != settings.REDIS_TEST_DB, "Redis test database is the one the app uses. Aborting tests."
+        redis_options["db"] = settings.REDIS_TEST_DB
+        RedisClient = Redis(connection_pool=ConnectionPool(**redis_options))
+
         def test_redis():
-            RedisClient = Redis(
-                host=settings.REDIS_HOST,
-                port=settings.REDIS_PORT,
-                db=1
-            )
-            yield RedisClient
-            RedisClient.flushdb()
+            return RedisClient
 
         #get to use SessionLocal received from fixture_Force db change
-        app.dependency_overrides[get_db] = override_get_db
+        app.dependency_overrides[get_async_db] = override_get_async_db
+        app.dependency_overrides[get_async_read_db] = override_get_async_db
         app.dependency_overrides[get_redis] = test_redis
         # Run tests
         f(*args, **kwargs)
         # get_Undo db
-        app.dependency_overrides[get_db] = get_db
+        app.dependency_overrides[get_async_db] = get_async_db
+        app.dependency_overrides[get_async_read_db] = get_async_read_db
+        app.dependency_overrides[get_redis] = get_redis
+        RedisClient.flushdb()
+        RedisClient.close()
+        RateLimit.blocked_until.clear()
     return func
 
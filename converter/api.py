@@ -1,36 +1,56 @@
+from datetime import date, datetime
 from typing import List, Optional
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from redis import Redis
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from auth.api import get_user
+from auth.api import UserRateLimit, get_user
 from auth.exceptions import UnvalidatedCredentials
-from auth.models import User
-from db.db import get_db, get_redis
+from auth.schema import PrincipalSchema
+from backend.rate_limit import RateLimit
+from backend.settings import settings
+from db.db import get_async_db, get_async_read_db, get_redis
 
-from .exceptions import CurrencyNotSupported
-from .models import ConversionHistory
+from .exceptions import CurrencyNotSupported, InternalStatsDisabled
 from .schema import (
-    ConversionHistoryResponseSchema,
+    BatchConversionResponseSchema,
+    BatchConvertSchema,
+    ConversionHistoryPageSchema,
     ConversionResponseSchema,
+    ConversionSummarySchema,
     ConvertSchema,
     CurrencyListSchema,
     CurrencySchema,
+    ExportFormat,
+    ExportHistorySchema,
     GetHistorySchema,
+    HistorySummarySchema,
+    HistoryWriterStatsSchema,
+    MirrorStatsSchema,
+    SummaryGranularity,
 )
-from .services import ConverterService
+from .services import HISTORY_COLUMNS, ConverterService, conversion_mirrors
+from .snapshots import RateSnapshotService
+from .writer import history_writer
 
 
 router = APIRouter(prefix="/currencies")
 
 
+def internal_stats_enabled():
+    if not settings.INTERNAL_STATS_ENABLED:
+        raise InternalStatsDisabled
+
+
 @router.get(
     "/list",
     summary="Get list of currencies supported",
     response_model=CurrencyListSchema,
+    dependencies=[Depends(RateLimit("currencies"))],
 )
 async def get_currency_list(redis: Redis = Depends(get_redis)):
-    currency_list = ConverterService.get_currency_list(redis)
+    currency_list = await ConverterService.get_currency_list(redis)
     list_of_currencies = list()
 
     for key, value in currency_list.items():
@@ -39,15 +59,29 @@ async def get_currency_list(redis: Redis = Depends(get_redis)):
     return CurrencyListSchema(currencies=list_of_currencies)
 
 
+@router.get(
+    "/mirrors",
+    summary="Get latency and health of the upstream rate mirrors",
+    include_in_schema=False,
+    response_model=List[MirrorStatsSchema],
+    dependencies=[
+        Depends(internal_stats_enabled), Depends(RateLimit("internal_stats"))
+    ],
+)
+async def get_mirror_stats(redis: Redis = Depends(get_redis)):
+    return conversion_mirrors.stats(redis)
+
+
 @router.post(
     "/convert",
     summary="Convert one currency to another",
     response_model=ConversionResponseSchema,
+    dependencies=[Depends(UserRateLimit("convert"))],
 )
 async def convert_currency(
     body: ConvertSchema,
-    db: Session = Depends(get_db),
-    user: Optional[User] = Depends(get_user),
+    db: AsyncSession = Depends(get_async_db),
+    user: Optional[PrincipalSchema] = Depends(get_user),
     redis: Redis = Depends(get_redis)
 ):
     if not user:
@@ -58,43 +92,199 @@ async def convert_currency(
     body.from_currency = body.from_currency.lower()
     body.to_currency = body.to_currency.lower()
 
-    for currency in (body.from_currency, body.to_currency):
-        if not ConverterService.currency_is_supported(currency, redis):
-            raise CurrencyNotSupported(currency)
+    currencies = (body.from_currency, body.to_currency)
+    pivot_rates = None
+    if body.as_of:
+        # the snapshot of the day tells which currencies it can convert
+        pivot_rates = await RateSnapshotService(db).get_pivot_rates(body.as_of)
+        unsupported = RateSnapshotService.unsupported_currencies(
+            currencies, pivot_rates
+        )
+    else:
+        unsupported = await ConverterService.unsupported_currencies(
+            currencies, redis
+        )
+
+    if unsupported:
+        raise CurrencyNotSupported(unsupported[0])
 
-    conversion_result = ConverterService.convert(body)
-    ConverterService(db).store_conversion_to_history(
+    conversion_result = await ConverterService.convert(
+        body, redis, pivot_rates=pivot_rates
+    )
+    await ConverterService(db).store_conversion_to_history(
         payload=conversion_result, user=user.id
     )
 
     return conversion_result
 
 
+@router.post(
+    "/convert/batch",
+    summary="Convert many amounts in one request",
+    response_model=BatchConversionResponseSchema,
+    dependencies=[Depends(UserRateLimit("convert_batch"))],
+)
+async def convert_currencies(
+    body: BatchConvertSchema,
+    db: AsyncSession = Depends(get_async_db),
+    user: Optional[PrincipalSchema] = Depends(get_user),
+    redis: Redis = Depends(get_redis)
+):
+    if not user:
+        raise UnvalidatedCredentials
+
+    for conversion in body.conversions:
+        conversion.from_currency = conversion.from_currency.lower()
+        conversion.to_currency = conversion.to_currency.lower()
+
+    currencies = sorted(
+        {
+            currency
+            for conversion in body.conversions
+            for currency in (conversion.from_currency, conversion.to_currency)
+        }
+    )
+    pivot_rates = None
+    if body.as_of:
+        pivot_rates = await RateSnapshotService(db).get_pivot_rates(body.as_of)
+        unsupported = RateSnapshotService.unsupported_currencies(
+            currencies, pivot_rates
+        )
+    else:
+        unsupported = await ConverterService.unsupported_currencies(
+            currencies, redis
+        )
+
+    if unsupported:
+        raise CurrencyNotSupported(unsupported[0])
+
+    conversion_results = await ConverterService.convert_many(
+        body.conversions, redis, pivot_rates=pivot_rates
+    )
+    await ConverterService(db).store_conversions_to_history(
+        payloads=conversion_results, user=user.id
+    )
+
+    return BatchConversionResponseSchema(conversions=conversion_results)
+
+
 @router.get(
     "/history",
     summary="Get a history of your conversions",
-    response_model=List[ConversionHistoryResponseSchema],
+    response_model=ConversionHistoryPageSchema,
+    dependencies=[Depends(UserRateLimit("history"))],
 )
 async def get_history(
     from_currency: str = None,
     to_currency: str = None,
-    db: Session = Depends(get_db),
-    user: Optional[User] = Depends(get_user),
+    start: datetime = None,
+    end: datetime = None,
+    cursor: str = None,
+    limit: int = Query(settings.PAGE_SIZE, gt=0, le=settings.MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_async_read_db),
+    user: Optional[PrincipalSchema] = Depends(get_user),
 ):
     if not user:
         raise UnvalidatedCredentials
 
-    payload = GetHistorySchema(from_currency=from_currency, to_currency=to_currency)
+    payload = GetHistorySchema(
+        from_currency=from_currency,
+        to_currency=to_currency,
+        start=start,
+        end=end,
+        cursor=cursor,
+        limit=limit,
+    )
 
-    history = ConverterService(db).get_conversion_history(payload=payload, user=user)
+    history, next_cursor = await ConverterService(db).get_conversion_history(
+        payload=payload, user=user
+    )
 
-    parsed_history = list(
-        map(
-            lambda item: ConversionHistoryResponseSchema(
-                **ConversionHistory.to_dict(item)
-            ),
-            history,
-        )
+    # the rows already hold what the schema would, so they are encoded
+    # as they are instead of going through it. zip leaves out the id
+    return ORJSONResponse(
+        {
+            "results": [dict(zip(HISTORY_COLUMNS, row)) for row in history],
+            "next_cursor": next_cursor,
+        }
+    )
+
+
+@router.get(
+    "/history/buffer",
+    summary="Get the number of conversions waiting to be written to history",
+    include_in_schema=False,
+    response_model=HistoryWriterStatsSchema,
+    dependencies=[
+        Depends(internal_stats_enabled), Depends(RateLimit("internal_stats"))
+    ],
+)
+async def get_history_buffer_stats():
+    return history_writer.stats()
+
+
+@router.get(
+    "/history/summary",
+    summary="Get the totals of your conversions per pair per day, week or month",
+    response_model=List[ConversionSummarySchema],
+    dependencies=[Depends(UserRateLimit("history_summary"))],
+)
+async def get_history_summary(
+    granularity: SummaryGranularity = SummaryGranularity.day,
+    from_currency: str = None,
+    to_currency: str = None,
+    start: date = None,
+    end: date = None,
+    db: AsyncSession = Depends(get_async_read_db),
+    user: Optional[PrincipalSchema] = Depends(get_user),
+):
+    if not user:
+        raise UnvalidatedCredentials
+
+    payload = HistorySummarySchema(
+        from_currency=from_currency, to_currency=to_currency, start=start, end=end
+    )
+
+    summaries = await ConverterService(db).get_conversion_summary(
+        payload=payload, user=user, granularity=granularity
     )
 
-    return parsed_history
+    return [ConversionSummarySchema(**summary._mapping) for summary in summaries]
+
+
+@router.get(
+    "/history/export",
+    summary="Download your whole history of conversions as NDJSON or CSV",
+    response_class=StreamingResponse,
+    dependencies=[Depends(UserRateLimit("history_export"))],
+)
+async def export_history(
+    file_format: ExportFormat = Query(ExportFormat.ndjson, alias="format"),
+    from_currency: str = None,
+    to_currency: str = None,
+    start: datetime = None,
+    end: datetime = None,
+    db: AsyncSession = Depends(get_async_read_db),
+    user: Optional[PrincipalSchema] = Depends(get_user),
+):
+    if not user:
+        raise UnvalidatedCredentials
+
+    payload = ExportHistorySchema(
+        from_currency=from_currency, to_currency=to_currency, start=start, end=end
+    )
+
+    content = await ConverterService(db).export_conversion_history(
+        payload=payload, user=user, file_format=file_format
+    )
+    media_type = (
+        "text/csv" if file_format == ExportFormat.csv else "application/x-ndjson"
+    )
+
+    return StreamingResponse(
+        content,
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f"attachment; filename=history.{file_format.value}"
+        },
+    )
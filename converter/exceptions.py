@@ -10,3 +10,18 @@ CurrencyNotSupported = lambda currency: HTTPException(
     status_code=status.HTTP_400_BAD_REQUEST,
     detail=f"{currency} is not supported."
 )
+
+InvalidCursor = HTTPException(
+    status_code=status.HTTP_400_BAD_REQUEST,
+    detail="The cursor is invalid",
+)
+
+RateSnapshotNotFound = lambda day: HTTPException(
+    status_code=status.HTTP_404_NOT_FOUND,
+    detail=f"There are no rates for {day}",
+)
+
+InternalStatsDisabled = HTTPException(
+    status_code=status.HTTP_404_NOT_FOUND,
+    detail="Not Found",
+)
@@ -2,17 +2,27 @@ from datetime import datetime
 from typing import Type
 from uuid import uuid4
 
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import JSONB, UUID
 
-from sqlalchemy import Column, DateTime, Float, ForeignKey, String
+from sqlalchemy import (
+    Column,
+    Date,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    UniqueConstraint,
+)
 from sqlalchemy.orm import relationship
 
 from db.base import Base
 
 
 class ConversionHistory(Base):
-    from_currency = Column(String(12), index=True, nullable=False)
-    to_currency = Column(String(12), index=True, nullable=False)
+    from_currency = Column(String(12), nullable=False)
+    to_currency = Column(String(12), nullable=False)
     amount = Column(Float, nullable=False)
     rate = Column(Float, nullable=False)
     result = Column(Float, nullable=False)
@@ -20,7 +30,11 @@ class ConversionHistory(Base):
         UUID(as_uuid=True), ForeignKey("user.id", ondelete="CASCADE"), nullable=False
     )
     user = relationship("User")
-    timestamp = Column(DateTime(timezone=True), default=datetime.utcnow())
+    # the table is partitioned by month on timestamp, which makes it part
+    # of the primary key
+    timestamp = Column(
+        DateTime(timezone=True), primary_key=True, default=datetime.utcnow
+    )
 
     @classmethod
     def to_dict(cls, instance: Type[Base]):
@@ -34,3 +48,65 @@ class ConversionHistory(Base):
             result[column.name] = str(getattr(instance, column.name))
 
         return result
+
+
+Index(
+    "ix_conversionhistory_user_timestamp",
+    ConversionHistory.user_id,
+    ConversionHistory.timestamp.desc(),
+    ConversionHistory.id.desc(),
+)
+Index(
+    "ix_conversionhistory_user_pair_timestamp",
+    ConversionHistory.user_id,
+    ConversionHistory.from_currency,
+    ConversionHistory.to_currency,
+    ConversionHistory.timestamp,
+)
+Index(
+    "ix_conversionhistory_timestamp_brin",
+    ConversionHistory.timestamp,
+    postgresql_using="brin",
+)
+
+
+class ConversionSummary(Base):
+    """
+    Totals of the conversions of a user per pair per day (in UTC), kept up
+    to date as history is written so they never have to be worked out
+    from the history itself
+    """
+    user_id = Column(
+        UUID(as_uuid=True), ForeignKey("user.id", ondelete="CASCADE"), nullable=False
+    )
+    from_currency = Column(String(12), nullable=False)
+    to_currency = Column(String(12), nullable=False)
+    day = Column(Date, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    total_amount = Column(Float, nullable=False, default=0)
+    total_result = Column(Float, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "user_id",
+            "day",
+            "from_currency",
+            "to_currency",
+            name="uq_conversionsummary_user_day_pair",
+        ),
+    )
+
+
+class RateSnapshot(Base):
+    """
+    The rates of every currency against `base` as they were on `day` (in
+    UTC). Today's snapshot follows the rates through the day and is fixed
+    once the day is over
+    """
+    base = Column(String(12), nullable=False)
+    day = Column(Date, nullable=False)
+    rates = Column(JSONB, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("base", "day", name="uq_ratesnapshot_base_day"),
+    )
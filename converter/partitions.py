@@ -0,0 +1,155 @@
+import logging
+import re
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from backend.services import BaseService
+from backend.settings import settings
+
+from .models import ConversionHistory
+
+
+MONTHLY_PARTITION = re.compile(r"_y(\d{4})m(\d{2})$")
+
+
+def month_start(day: date, months: int = 0) -> date:
+    """
+    The first day of the month `months` months after the one `day` is in
+    """
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+class HistoryPartitionService(BaseService):
+    """
+    Looks after the monthly partitions of conversion history. Partitions
+    are created before the months they hold begin, and whole partitions
+    past the retention period are detached and dropped, which is far
+    cheaper than deleting their rows and leaves nothing behind to vacuum.
+    """
+    TABLE = ConversionHistory.__tablename__
+    # held for the length of the transaction so only one worker
+    # maintains the partitions at a time
+    ADVISORY_LOCK_ID = 7_315_015
+
+    def partition_name(self, month: date) -> str:
+        return f"{self.TABLE}_y{month.year:04d}m{month.month:02d}"
+
+    def is_partitioned(self) -> bool:
+        return bool(
+            self.db.execute(
+                text(
+                    "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+                    "WHERE partrelid = to_regclass(:table))"
+                ),
+                {"table": self.TABLE},
+            ).scalar()
+        )
+
+    def partitions(self) -> Dict[date, str]:
+        """
+        The monthly partitions attached to the table, by the month they hold
+        """
+        names = self.db.execute(
+            text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE pg_inherits.inhparent = to_regclass(:table)"
+            ),
+            {"table": self.TABLE},
+        ).scalars()
+
+        partitions = {}
+        for name in names:
+            # skips the default partition
+            if match := MONTHLY_PARTITION.search(name):
+                year, month = map(int, match.groups())
+                partitions[date(year, month, 1)] = name
+
+        return partitions
+
+    def create_partitions(self, today: date, months_ahead: int) -> List[str]:
+        """
+        Creates the partitions of this month and the next `months_ahead`
+        that don't exist yet
+        """
+        existing = self.partitions()
+        created = []
+
+        for months in range(months_ahead + 1):
+            month = month_start(today, months)
+            if month in existing:
+                continue
+
+            name = self.partition_name(month)
+            self.db.execute(
+                text(
+                    f'CREATE TABLE IF NOT EXISTS "{name}" '
+                    f'PARTITION OF "{self.TABLE}" '
+                    f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') "
+                    f"TO ('{month_start(month, 1).isoformat()} 00:00:00+00')"
+                )
+            )
+            created.append(name)
+
+        return created
+
+    def apply_retention(self, today: date, months: int, drop: bool) -> List[str]:
+        """
+        Detaches the partitions of months that ended more than `months`
+        months ago, and drops them too when `drop` is set
+        """
+        if months <= 0:
+            return []
+
+        oldest_kept = month_start(today, -months)
+        removed = []
+
+        for month, name in sorted(self.partitions().items()):
+            if month >= oldest_kept:
+                break
+
+            self.db.execute(
+                text(f'ALTER TABLE "{self.TABLE}" DETACH PARTITION "{name}"')
+            )
+            if drop:
+                self.db.execute(text(f'DROP TABLE "{name}"'))
+            removed.append(name)
+
+        return removed
+
+    def maintain(self, today: Optional[date] = None) -> Tuple[List[str], List[str]]:
+        """
+        Creates upcoming partitions and applies the retention policy.
+        Returns the partitions created and removed. Does nothing when the
+        table isn't partitioned or another worker is already at it
+        """
+        today = today or datetime.utcnow().date()
+
+        if not self.is_partitioned():
+            return [], []
+
+        locked = self.db.execute(
+            text("SELECT pg_try_advisory_xact_lock(:id)"),
+            {"id": self.ADVISORY_LOCK_ID},
+        ).scalar()
+        if not locked:
+            self.db.rollback()
+            return [], []
+
+        created = self.create_partitions(today, settings.HISTORY_PARTITIONS_AHEAD)
+        removed = self.apply_retention(
+            today,
+            settings.HISTORY_RETENTION_MONTHS,
+            drop=settings.HISTORY_RETENTION_DROP,
+        )
+        self.db.commit()
+
+        if created or removed:
+            logging.info(
+                "History partitions created: %s, removed: %s", created, removed
+            )
+
+        return created, removed
@@ -1,8 +1,10 @@
-from datetime import datetime
+from datetime import date, datetime
+from enum import Enum
 from typing import List, Optional
 
 from pydantic import Field
 
+from backend.settings import settings
 from db.schema import BaseSchema
 
 
@@ -14,10 +16,59 @@ class HistorySchema(BaseSchema):
 
 class GetHistorySchema(BaseSchema):
     """
-    Request body for parsing calls to get history
+    Request body for parsing calls to get history. `start` is inclusive
+    and `end` is not
     """
     from_currency: Optional[str]
     to_currency: Optional[str]
+    start: Optional[datetime]
+    end: Optional[datetime]
+    cursor: Optional[str]
+    limit: int = settings.PAGE_SIZE
+
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+class ExportHistorySchema(BaseSchema):
+    """
+    Filters for exporting history. `start` is inclusive and `end` is not
+    """
+    from_currency: Optional[str]
+    to_currency: Optional[str]
+    start: Optional[datetime]
+    end: Optional[datetime]
+
+
+class SummaryGranularity(str, Enum):
+    day = "day"
+    week = "week"
+    month = "month"
+
+
+class HistorySummarySchema(BaseSchema):
+    """
+    Filters for summarising history. `start` is inclusive and `end` is not
+    """
+    from_currency: Optional[str]
+    to_currency: Optional[str]
+    start: Optional[date]
+    end: Optional[date]
+
+
+class ConversionSummarySchema(BaseSchema):
+    """
+    Totals of the conversions of a pair in the period starting on `period`.
+    Weeks start on Monday
+    """
+    period: date
+    from_currency: str
+    to_currency: str
+    count: int
+    total_amount: float
+    total_result: float
 
 
 class CurrencySchema(BaseSchema):
@@ -29,15 +80,36 @@ class CurrencyListSchema(BaseSchema):
     currencies: List[CurrencySchema]
 
 
-class ConvertSchema(BaseSchema):
+class ConversionSchema(BaseSchema):
     """
-    Parses body for requests to convert currencies
+    An amount to convert from one currency to another
     """
     from_currency: str
     to_currency: str
     amount: float = Field(gt=0, description="The amount must be greater than zero")
 
 
+class ConvertSchema(ConversionSchema):
+    """
+    Parses body for requests to convert currencies
+    """
+    as_of: Optional[date] = Field(
+        description="Convert at the rates of this past day rather than the latest"
+    )
+
+
+class BatchConvertSchema(BaseSchema):
+    """
+    Parses body for requests to convert many amounts at once
+    """
+    conversions: List[ConversionSchema] = Field(
+        min_items=1, max_items=settings.BATCH_CONVERSION_LIMIT
+    )
+    as_of: Optional[date] = Field(
+        description="Convert at the rates of this past day rather than the latest"
+    )
+
+
 class ConversionResponseSchema(BaseSchema):
     """
     Schema for results of conversions
@@ -49,5 +121,42 @@ class ConversionResponseSchema(BaseSchema):
     result: float
 
 
+class BatchConversionResponseSchema(BaseSchema):
+    conversions: List[ConversionResponseSchema]
+
+
 class ConversionHistoryResponseSchema(ConversionResponseSchema):
     timestamp: datetime
+
+
+class ConversionHistoryPageSchema(BaseSchema):
+    """
+    A page of history. Pass `next_cursor` back as `cursor` to get the
+    next page, it is empty on the last page
+    """
+    results: List[ConversionHistoryResponseSchema]
+    next_cursor: Optional[str]
+
+
+class MirrorStatsSchema(BaseSchema):
+    """
+    Health of an upstream mirror. Latency is this worker's moving average
+    in seconds while the circuit state and error rate are shared by every
+    worker
+    """
+    mirror: str
+    latency: Optional[float]
+    successes: int
+    failures: int
+    circuit: str
+    error_rate: float
+
+
+class HistoryWriterStatsSchema(BaseSchema):
+    """
+    State of this worker's buffer of conversions waiting to be written
+    """
+    depth: int
+    written: int
+    failed_flushes: int
+    dead_lettered: int
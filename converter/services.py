@@ -1,129 +1,495 @@
+import asyncio
+import csv
+import io
 import json
 import logging
-from typing import Any, Dict, List, Optional
+import time
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from urllib.parse import urlsplit
 from uuid import UUID
 from redis import Redis
 
-import requests
-from auth.models import User
-
-from backend.services import BaseService
-from backend.settings import settings
+import httpx
+import numpy as np
+from sqlalchemy import Date, cast, func, literal_column, select, tuple_
+from sqlalchemy.engine import Row
+from auth.schema import PrincipalSchema
+
+from backend.cache import (
+    VERSION_REDIS_KEY,
+    SingleFlight,
+    local_cache,
+    read_cache,
+    write_cache,
+)
+from backend.circuit_breaker import CircuitBreaker
+from backend.http import get_http_client
+from backend.services import AsyncBaseService
+from backend.settings import RatePolicy, redis_key, settings
 
 from . import exceptions
-from .models import ConversionHistory
+from .models import ConversionHistory, ConversionSummary
+from .writer import history_row, history_writer, insert_history
 from .schema import (
     ConversionResponseSchema,
-    ConvertSchema,
+    ConversionSchema,
+    ExportFormat,
+    ExportHistorySchema,
     GetHistorySchema,
     HistorySchema,
+    HistorySummarySchema,
+    SummaryGranularity,
 )
 
 
+# each of these returns the rates of every supported currency
+# against the base currency it is formatted with
 CONVERSION_APIS = [
-    "https://cdn.jsdelivr.net/gh/fawazahmed0/currency-api@1/latest/currencies/{}/{}.min.json",
-    "https://cdn.jsdelivr.net/gh/fawazahmed0/currency-api@1/latest/currencies/{}/{}.json",
-    "https://raw.githubusercontent.com/fawazahmed0/currency-api/1/latest/currencies/{}/{}.min.json",
-    "https://raw.githubusercontent.com/fawazahmed0/currency-api/1/latest/currencies/{}/{}.json",
+    "https://cdn.jsdelivr.net/gh/fawazahmed0/currency-api@1/latest/currencies/{}.min.json",
+    "https://cdn.jsdelivr.net/gh/fawazahmed0/currency-api@1/latest/currencies/{}.json",
+    "https://raw.githubusercontent.com/fawazahmed0/currency-api/1/latest/currencies/{}.min.json",
+    "https://raw.githubusercontent.com/fawazahmed0/currency-api/1/latest/currencies/{}.json",
 ]
 
 
-def make_request(url, **kwargs) -> Dict[str, Any]:
+async def make_request(url, **kwargs) -> Dict[str, Any]:
     """
     Non-generic utility to make a request to the given URL.
     """
-    response = requests.get(url, **kwargs)
-    response.raise_for_status()
-    return response.json()
+    async with get_http_client() as client:
+        response = await client.get(url, **kwargs)
+        response.raise_for_status()
+        return response.json()
 
 
-def make_request_with_retries(urls, **kwargs) -> Dict[str, Any]:
+def encode_cursor(history: Row) -> str:
     """
-    Makes request to each url in urls untl one works.
+    Creates an opaque cursor pointing just past a row of history
     """
-    response = None
+    position = f"{history.timestamp.isoformat()}|{history.id}"
+    return urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        timestamp, id = urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), UUID(id)
+    except ValueError:
+        raise exceptions.InvalidCursor
+
+
+# columns of a page of history, in the order of ConversionHistoryResponseSchema
+HISTORY_COLUMNS = (
+    "from_currency", "to_currency", "amount", "rate", "result", "timestamp"
+)
+EXPORT_COLUMNS = ("timestamp", "from_currency", "to_currency", "amount", "rate", "result")
+
+
+def export_row(row: Tuple) -> Tuple:
+    timestamp, *values = row
+    return (timestamp.isoformat() if timestamp else None, *values)
+
+
+async def export_ndjson(batches: AsyncIterator[Sequence[Tuple]]) -> AsyncIterator[str]:
+    async for rows in batches:
+        yield "".join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, export_row(row)))) + "\n"
+            for row in rows
+        )
 
-    for url in urls:
-        try:
-            response = make_request(url, **kwargs)
-            break
-        except requests.HTTPError:
-            continue
 
-    return response
+async def export_csv(batches: AsyncIterator[Sequence[Tuple]]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
 
+    async for rows in batches:
+        writer.writerows(export_row(row) for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
 
-def craft_conversion_urls(_from, to):
+    # just the header when there is no history
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class MirrorPool:
     """
-    Creates API endpoints to be called to convert a currency
+    Requests the same resource from a list of mirrors. Keeps a moving
+    average of how long each mirror takes so the fastest one is always
+    tried first, and can hedge a slow mirror by racing the next one.
+    Mirrors whose host has an open circuit are skipped.
     """
-    urls = list(map(lambda url: url.format(_from, to), CONVERSION_APIS))
+    def __init__(self, mirrors: List[str]) -> None:
+        self.mirrors = list(mirrors)
+        self.latencies: Dict[str, Optional[float]] = {
+            mirror: None for mirror in self.mirrors
+        }
+        self.successes: Dict[str, int] = {mirror: 0 for mirror in self.mirrors}
+        self.failures: Dict[str, int] = {mirror: 0 for mirror in self.mirrors}
+
+    def record_latency(self, mirror: str, latency: float) -> None:
+        average = self.latencies[mirror]
+        smoothing = settings.UPSTREAM_LATENCY_SMOOTHING
+
+        if average is None:
+            self.latencies[mirror] = latency
+        else:
+            self.latencies[mirror] = average + smoothing * (latency - average)
+
+    def record_success(self, mirror: str, latency: float) -> None:
+        self.successes[mirror] += 1
+        self.record_latency(mirror, latency)
+
+    def record_failure(self, mirror: str) -> None:
+        # a failure costs as much as the slowest answer we would accept
+        # so a broken mirror sinks to the bottom of the ranking
+        self.failures[mirror] += 1
+        self.record_latency(mirror, settings.HTTP_READ_TIMEOUT)
+
+    def ranked(self) -> List[str]:
+        """
+        Mirrors from fastest to slowest. Mirrors that have not been
+        measured yet come first so they get a chance to prove themselves
+        """
+        return sorted(self.mirrors, key=lambda mirror: self.latencies[mirror] or 0)
+
+    def breakers(self, redis_client: Redis) -> Dict[str, CircuitBreaker]:
+        hosts = {urlsplit(mirror).netloc for mirror in self.mirrors}
+        return {host: CircuitBreaker(host, redis_client) for host in hosts}
+
+    def available(self, breakers: Dict[str, CircuitBreaker]) -> Iterator[str]:
+        """
+        Ranked mirrors whose host is currently accepting calls
+        """
+        for mirror in self.ranked():
+            if breakers[urlsplit(mirror).netloc].allow_request():
+                yield mirror
+
+    def stats(self, redis_client: Redis) -> List[Dict[str, Any]]:
+        breakers = self.breakers(redis_client)
+        health = {host: breaker.health() for host, breaker in breakers.items()}
+
+        return [
+            {
+                "mirror": mirror,
+                "latency": self.latencies[mirror],
+                "successes": self.successes[mirror],
+                "failures": self.failures[mirror],
+                "circuit": health[urlsplit(mirror).netloc]["state"],
+                "error_rate": health[urlsplit(mirror).netloc]["error_rate"],
+            }
+            for mirror in self.ranked()
+        ]
+
+    async def timed_request(
+        self, mirror: str, breaker: CircuitBreaker, *args
+    ) -> Dict[str, Any]:
+        started = time.monotonic()
 
-    return urls
+        try:
+            response = await make_request(mirror.format(*args))
+        except Exception:
+            self.record_failure(mirror)
+            breaker.record_failure()
+            raise
+
+        latency = time.monotonic() - started
+        self.record_success(mirror, latency)
+        breaker.record_success(latency)
+        return response
+
+    async def request_in_turn(
+        self, breakers: Dict[str, CircuitBreaker], *args
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Makes request to each mirror until one works.
+        """
+        for mirror in self.available(breakers):
+            try:
+                return await self.timed_request(
+                    mirror, breakers[urlsplit(mirror).netloc], *args
+                )
+            except (httpx.HTTPError, ValueError):
+                continue
+
+        return None
+
+    async def hedged_request(
+        self, breakers: Dict[str, CircuitBreaker], *args
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Requests the fastest mirror and fires the next one each time
+        UPSTREAM_HEDGE_DELAY passes without an answer or a mirror fails.
+        The first good answer wins and the other requests are cancelled.
+        """
+        mirrors = self.available(breakers)
+        # the mirror of each request still running and when it was sent
+        pending: Dict[asyncio.Future, Tuple[str, float]] = {}
+        won_in: Optional[float] = None
 
+        def hedge() -> None:
+            mirror = next(mirrors, None)
+            if mirror is not None:
+                breaker = breakers[urlsplit(mirror).netloc]
+                task = asyncio.ensure_future(self.timed_request(mirror, breaker, *args))
+                pending[task] = (mirror, time.monotonic())
 
-class ConverterService(BaseService):
-    CURRENCIES_REDIS_KEY = "currencies"
+        hedge()
 
-    def add_history(self, history: HistorySchema) -> None:
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending.keys(),
+                    timeout=settings.UPSTREAM_HEDGE_DELAY,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+
+                for task in done:
+                    _, started = pending.pop(task)
+                    if task.exception() is None:
+                        won_in = time.monotonic() - started
+                        return task.result()
+
+                hedge()
+        finally:
+            now = time.monotonic()
+            for task, (mirror, started) in pending.items():
+                if task.done():
+                    # finished along with the winner. Its failure was
+                    # charged by timed_request, and reading it keeps it
+                    # from being logged as never retrieved
+                    if not task.cancelled():
+                        task.exception()
+                    continue
+
+                task.cancel()
+                if won_in is not None:
+                    # it lost the race, so it is slower than the winner by
+                    # an unknown amount. Charging it the time of the winner
+                    # plus a hedge keeps it behind even when it was sent
+                    # last, so a mirror that hangs sinks in the ranking
+                    self.record_latency(
+                        mirror,
+                        max(now - started, won_in) + settings.UPSTREAM_HEDGE_DELAY,
+                    )
+
+        return None
+
+    async def request(self, redis_client: Redis, *args) -> Optional[Dict[str, Any]]:
+        breakers = self.breakers(redis_client)
+
+        if settings.UPSTREAM_HEDGING:
+            return await self.hedged_request(breakers, *args)
+
+        return await self.request_in_turn(breakers, *args)
+
+
+conversion_mirrors = MirrorPool(CONVERSION_APIS)
+
+# so an expired key is fetched from upstream once, not by every request
+cache_refills = SingleFlight()
+
+
+class ConverterService(AsyncBaseService):
+    CURRENCIES_REDIS_KEY = redis_key("currencies")
+    # set of the supported currency codes, kept in step with the list
+    CURRENCY_CODES_REDIS_KEY = redis_key("currencies:codes")
+    RATES_REDIS_KEY = redis_key("rates:{}")
+    # this worker's copy of the supported codes: the version of the list it
+    # came from and when that version was last confirmed with Redis
+    currency_codes: Tuple[int, FrozenSet[str], float] = (-1, frozenset(), 0.0)
+    # when each base was last converted from in this worker, so the
+    # refresher knows which rate tables to keep warm
+    rate_tables_in_use: Dict[str, float] = {}
+
+    async def add_history(self, history: HistorySchema) -> None:
         """
         Add a conversion to record
         """
         history_to_save = ConversionHistory(**history.to_dict())
-        self.save(history_to_save)
+        await self.save(history_to_save)
 
     @classmethod
-    def cache_currency_list(cls, redis_client: Redis):
+    async def get_cached(
+        cls, key: str, redis_client: Redis, fill: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """
+        Serves `key` from the cache, trying the copy in this process before
+        Redis. A stale value is served as it is while it gets refreshed in
+        the background, so a request only waits on upstream when there is
+        nothing cached at all
+        """
+        def read_any() -> Optional[Any]:
+            cached = read_cache(redis_client, key)
+            return cached.data if cached else None
+
+        def read_fresh() -> Optional[Any]:
+            cached = read_cache(redis_client, key)
+            return cached.data if cached and not cached.is_stale else None
+
+        cached = local_cache.get(key, redis_client)
+
+        if cached is None:
+            return await cache_refills.load(key, redis_client, read_any, fill)
+
+        if cached.is_stale:
+            cache_refills.load_in_background(key, redis_client, read_fresh, fill)
+
+        return cached.data
+
+    @classmethod
+    async def cache_currency_list(cls, redis_client: Redis) -> Dict[str, str]:
         """
         Request for supported currencies and
         cache it for future replies for that day
         """
-        if redis_client.get(cls.CURRENCIES_REDIS_KEY):
-            return
-
         url = "https://cdn.jsdelivr.net/gh/fawazahmed0/currency-api@1/latest/currencies.min.json"
 
         try:
-            currencies = make_request(url)
-        except requests.HTTPError:
+            currencies = await make_request(url)
+        except httpx.HTTPError:
             raise exceptions.APIIsDown
 
-        jsonified_currencies = json.dumps(currencies)
-        logging.info(jsonified_currencies)
-        redis_client.setex(
+        logging.info("Caching %s supported currencies", len(currencies))
+        # the list and the index of codes change together
+        pipeline = redis_client.pipeline()
+        pipeline.delete(cls.CURRENCY_CODES_REDIS_KEY)
+        pipeline.sadd(cls.CURRENCY_CODES_REDIS_KEY, *currencies)
+        pipeline.expire(
+            cls.CURRENCY_CODES_REDIS_KEY, settings.CURRENCY_CACHE_STALE_TIME
+        )
+        write_cache(
+            redis_client, cls.CURRENCIES_REDIS_KEY, currencies, pipeline=pipeline
+        )
+        pipeline.execute()
+
+        return currencies
+
+    @classmethod
+    async def get_currency_list(cls, redis_client: Redis) -> Dict[str, str]:
+        # fill up the cache again if it got removed.
+        return await cls.get_cached(
             cls.CURRENCIES_REDIS_KEY,
-            settings.CURRENCY_CACHE_EXPIRY_TIME,
-            jsonified_currencies,
+            redis_client,
+            fill=lambda: cls.cache_currency_list(redis_client),
         )
 
     @classmethod
-    def get_currency_list(cls, redis_client: Redis) -> Dict[str, str]:
-        currencies: str = redis_client.get(cls.CURRENCIES_REDIS_KEY)
+    async def unsupported_currencies(
+        cls, currencies: Iterable[str], redis_client: Redis
+    ) -> List[str]:
+        """
+        Returns the currencies that are not supported by the API. Answered
+        from an in-memory set of codes when this worker checked it recently,
+        otherwise with one pipelined round trip to the index in Redis
+        """
+        currencies = list(currencies)
+        version, codes, checked_at = cls.currency_codes
+
+        if time.monotonic() - checked_at < settings.LOCAL_CACHE_TTL:
+            return [currency for currency in currencies if currency not in codes]
+
+        pipeline = redis_client.pipeline(transaction=False)
+        pipeline.get(VERSION_REDIS_KEY.format(cls.CURRENCIES_REDIS_KEY))
+        pipeline.exists(cls.CURRENCY_CODES_REDIS_KEY)
+        for currency in currencies:
+            pipeline.sismember(cls.CURRENCY_CODES_REDIS_KEY, currency)
+        latest_version, index_exists, *supported = pipeline.execute()
+
+        if not index_exists:
+            # nothing cached yet, so the list has to be fetched anyway
+            currency_list = await cls.get_currency_list(redis_client)
+            supported = [currency in currency_list for currency in currencies]
+        else:
+            latest_version = int(latest_version or 0)
+            if latest_version != version:
+                codes = frozenset(
+                    code.decode()
+                    for code in redis_client.smembers(cls.CURRENCY_CODES_REDIS_KEY)
+                )
+            cls.currency_codes = (latest_version, codes, time.monotonic())
+
+        return [
+            currency
+            for currency, is_supported in zip(currencies, supported)
+            if not is_supported
+        ]
+
+    @classmethod
+    async def cache_rate_table(
+        cls, base: str, redis_client: Redis
+    ) -> Dict[str, float]:
+        """
+        Request for the rates of every currency against `base` and
+        cache them so later conversions from `base` don't go upstream
+        """
+        response = await conversion_mirrors.request(redis_client, base)
+
+        if not response or base not in response:
+            raise exceptions.APIIsDown
 
-        if not currencies:
-            # fill up the cache again if it got removed.
-            cls.cache_currency_list(redis_client)
-            currencies = redis_client.get(cls.CURRENCIES_REDIS_KEY)
+        rates: Dict[str, float] = response[base]
+        write_cache(redis_client, cls.RATES_REDIS_KEY.format(base), rates)
 
-        return json.loads(currencies)
+        return rates
 
     @classmethod
-    def currency_is_supported(cls, currency: str, redis_client: Redis) -> bool:
+    async def get_rate_table(
+        cls, base: str, redis_client: Redis
+    ) -> Dict[str, float]:
+        cls.rate_tables_in_use[base] = time.time()
+
+        return await cls.get_cached(
+            cls.RATES_REDIS_KEY.format(base),
+            redis_client,
+            fill=lambda: cls.cache_rate_table(base, redis_client),
+        )
+
+    @classmethod
+    def hot_rate_tables(cls) -> List[str]:
         """
-        Checks if a currency is supported by the API
+        The pivot table and every other table used in the last
+        CURRENCY_CACHE_EXPIRY_TIME by this worker
         """
-        currency_from_cache = cls.get_currency_list(redis_client).get(currency)
-        return bool(currency_from_cache)
+        cutoff = time.time() - settings.CURRENCY_CACHE_EXPIRY_TIME
+
+        for base, last_used in list(cls.rate_tables_in_use.items()):
+            if last_used < cutoff:
+                cls.rate_tables_in_use.pop(base, None)
+
+        return list({settings.RATE_PIVOT_CURRENCY, *cls.rate_tables_in_use})
 
     @classmethod
-    def convert(cls, payload: ConvertSchema) -> ConversionResponseSchema:
+    async def convert(
+        cls,
+        payload: ConversionSchema,
+        redis_client: Redis,
+        pivot_rates: Optional[Dict[str, float]] = None,
+    ) -> ConversionResponseSchema:
         """
-        Converts money from one currency to another
+        Converts money from one currency to another, at the given pivot
+        rates if there are any and at the latest ones otherwise
         """
-        conversion_urls = craft_conversion_urls(
+        rate = await RateEngine(redis_client, pivot_rates=pivot_rates).rate(
             payload.from_currency, payload.to_currency
         )
-        rate = make_request_with_retries(conversion_urls).get(payload.to_currency)
 
         result = ConversionResponseSchema(
             rate=rate, result=rate * payload.amount, **payload.to_dict()
@@ -131,26 +497,313 @@ class ConverterService(BaseService):
 
         return result
 
-    def store_conversion_to_history(
+    @classmethod
+    async def convert_many(
+        cls,
+        payloads: List[ConversionSchema],
+        redis_client: Redis,
+        pivot_rates: Optional[Dict[str, float]] = None,
+    ) -> List[ConversionResponseSchema]:
+        """
+        Converts a batch of amounts. The rates of every distinct pair are
+        looked up once and all results come out of one vectorized product
+        """
+        sources = sorted({payload.from_currency for payload in payloads})
+        targets = sorted({payload.to_currency for payload in payloads})
+        rates = await RateEngine(redis_client, pivot_rates=pivot_rates).rate_matrix(
+            sources, targets
+        )
+
+        source_index = {currency: index for index, currency in enumerate(sources)}
+        target_index = {currency: index for index, currency in enumerate(targets)}
+        count = len(payloads)
+        rows = np.fromiter(
+            (source_index[payload.from_currency] for payload in payloads),
+            dtype=np.intp,
+            count=count,
+        )
+        columns = np.fromiter(
+            (target_index[payload.to_currency] for payload in payloads),
+            dtype=np.intp,
+            count=count,
+        )
+        amounts = np.fromiter(
+            (payload.amount for payload in payloads), dtype=np.float64, count=count
+        )
+
+        pair_rates = rates[rows, columns]
+        results = amounts * pair_rates
+
+        return [
+            ConversionResponseSchema(rate=rate, result=result, **payload.to_dict())
+            for payload, rate, result in zip(
+                payloads, pair_rates.tolist(), results.tolist()
+            )
+        ]
+
+    async def store_conversion_to_history(
         self, payload: ConversionResponseSchema, user: UUID
     ):
-        history_to_db = ConversionHistory(**payload.to_dict(), user_id=user)
-        self.save(history_to_db)
+        await self.store_conversions_to_history([payload], user)
+
+    async def store_conversions_to_history(
+        self, payloads: List[ConversionResponseSchema], user: UUID
+    ):
+        """
+        Records conversions. They are handed to the write-behind buffer when
+        it is running and has room, otherwise written right away
+        """
+        rows = [
+            history_row(dict(payload.to_dict(), user_id=user)) for payload in payloads
+        ]
+
+        if settings.HISTORY_WRITE_BEHIND and history_writer.enqueue(rows):
+            return
+
+        await insert_history(self.db, rows)
+
+    async def get_conversion_history(
+        self, payload: GetHistorySchema, user: PrincipalSchema
+    ) -> Tuple[List[Row], Optional[str]]:
+        """
+        Get a page of the history of conversions for a paticular user, newest
+        first, along with the cursor of the next page if there is one.
+        Pages seek past the (timestamp, id) of the cursor so they stay cheap
+        and stable however long the history gets.
 
-    def get_conversion_history(
-        self, payload: GetHistorySchema, user: User
-    ) -> List[ConversionHistory]:
+        Rows hold the HISTORY_COLUMNS followed by the id, rather than
+        whole models.
+        """
+        columns = [getattr(ConversionHistory, column) for column in HISTORY_COLUMNS]
+        histories = select(*columns, ConversionHistory.id).where(
+            ConversionHistory.user_id == user.id
+        )
+        if currency := payload.from_currency:
+            histories = histories.where(ConversionHistory.from_currency == currency)
+        if currency := payload.to_currency:
+            histories = histories.where(ConversionHistory.to_currency == currency)
+        # bounds on the timestamp let Postgres skip the monthly partitions
+        # outside of them
+        if payload.start:
+            histories = histories.where(ConversionHistory.timestamp >= payload.start)
+        if payload.end:
+            histories = histories.where(ConversionHistory.timestamp < payload.end)
+        if payload.cursor:
+            timestamp, id = decode_cursor(payload.cursor)
+            histories = histories.where(
+                ConversionHistory.timestamp <= timestamp,
+                tuple_(ConversionHistory.timestamp, ConversionHistory.id)
+                < (timestamp, id),
+            )
+
+        # one extra row tells us if there is a next page
+        histories = histories.order_by(
+            ConversionHistory.timestamp.desc(), ConversionHistory.id.desc()
+        ).limit(payload.limit + 1)
+        histories: List[Row] = (await self.db.execute(histories)).all()
+
+        if len(histories) <= payload.limit:
+            return histories, None
+
+        page = histories[:payload.limit]
+        return page, encode_cursor(page[-1])
+
+    async def export_conversion_history(
+        self, payload: ExportHistorySchema, user: PrincipalSchema, file_format: ExportFormat
+    ) -> AsyncIterator[str]:
+        """
+        Streams the history of a user, oldest first, as chunks of NDJSON
+        or CSV. Rows come from a server-side cursor HISTORY_EXPORT_CHUNK_SIZE
+        at a time so memory stays flat however many there are.
+        """
+        columns = [
+            getattr(ConversionHistory, column) for column in EXPORT_COLUMNS
+        ]
+        histories = select(*columns).where(ConversionHistory.user_id == user.id)
+        if currency := payload.from_currency:
+            histories = histories.where(ConversionHistory.from_currency == currency)
+        if currency := payload.to_currency:
+            histories = histories.where(ConversionHistory.to_currency == currency)
+        if payload.start:
+            histories = histories.where(ConversionHistory.timestamp >= payload.start)
+        if payload.end:
+            histories = histories.where(ConversionHistory.timestamp < payload.end)
+
+        rows = await self.db.stream(
+            histories.order_by(ConversionHistory.timestamp, ConversionHistory.id)
+        )
+        batches = rows.partitions(settings.HISTORY_EXPORT_CHUNK_SIZE)
+
+        if file_format == ExportFormat.csv:
+            return export_csv(batches)
+        return export_ndjson(batches)
+
+    async def get_conversion_summary(
+        self,
+        payload: HistorySummarySchema,
+        user: PrincipalSchema,
+        granularity: SummaryGranularity,
+    ) -> List[Tuple]:
         """
-        Get history of conversions for a paticular
+        Totals of the conversions of a user per pair per period, newest
+        period first. Only the daily summaries are read, so the cost grows
+        with the number of days and pairs rather than conversions.
         """
-        histories = self.db.query(ConversionHistory).filter(
-            ConversionHistory.user == user
+        # inlined rather than bound so the grouped expression is
+        # identical to the selected one
+        unit = literal_column(f"'{granularity.value}'")
+        period = cast(func.date_trunc(unit, ConversionSummary.day), Date).label(
+            "period"
         )
+
+        summaries = select(
+            period,
+            ConversionSummary.from_currency,
+            ConversionSummary.to_currency,
+            func.sum(ConversionSummary.count).label("count"),
+            func.sum(ConversionSummary.total_amount).label("total_amount"),
+            func.sum(ConversionSummary.total_result).label("total_result"),
+        ).where(ConversionSummary.user_id == user.id)
         if currency := payload.from_currency:
-            histories = histories.filter(ConversionHistory.from_currency == currency)
+            summaries = summaries.where(ConversionSummary.from_currency == currency)
         if currency := payload.to_currency:
-            histories = histories.filter(ConversionHistory.to_currency == currency)
+            summaries = summaries.where(ConversionSummary.to_currency == currency)
+        if payload.start:
+            summaries = summaries.where(ConversionSummary.day >= payload.start)
+        if payload.end:
+            summaries = summaries.where(ConversionSummary.day < payload.end)
+
+        summaries = summaries.group_by(
+            period, ConversionSummary.from_currency, ConversionSummary.to_currency
+        ).order_by(
+            period.desc(),
+            ConversionSummary.from_currency,
+            ConversionSummary.to_currency,
+        )
+
+        return (await self.db.execute(summaries)).all()
+
+
+class RateEngine:
+    """
+    Works out the rate of any pair of currencies. A single pivot table
+    covers every pair as `pivot[to] / pivot[from]` so one upstream fetch
+    is enough to answer all conversions.
+
+    Given `pivot_rates`, such as a snapshot of a past day, every rate is
+    worked out from them and nothing is fetched.
+    """
+    def __init__(
+        self,
+        redis_client: Redis,
+        pivot: str = settings.RATE_PIVOT_CURRENCY,
+        policy: RatePolicy = settings.RATE_POLICY,
+        pivot_rates: Optional[Dict[str, float]] = None,
+    ) -> None:
+        self.redis_client = redis_client
+        self.pivot = pivot
+        self.policy = policy
+        self.pivot_rates = pivot_rates
+
+    async def get_pivot_rates(self) -> Dict[str, float]:
+        if self.pivot_rates is not None:
+            return self.pivot_rates
+
+        return await ConverterService.get_rate_table(self.pivot, self.redis_client)
+
+    def uses_direct_rate(self, _from: str) -> bool:
+        if self.pivot_rates is not None:
+            return False
+
+        if self.policy == RatePolicy.DIRECT:
+            return True
 
-        histories: List[ConversionHistory] = histories.all()
+        if self.policy == RatePolicy.PREFER_DIRECT:
+            return bool(
+                self.redis_client.exists(
+                    ConverterService.RATES_REDIS_KEY.format(_from)
+                )
+            )
 
-        return histories
+        return False
+
+    async def direct_rate(self, _from: str, to: str) -> float:
+        rates = await ConverterService.get_rate_table(_from, self.redis_client)
+        if to == _from:
+            return 1.0
+
+        rate = rates.get(to)
+
+        if rate is None:
+            raise exceptions.CurrencyNotSupported(to)
+
+        return rate
+
+    async def cross_rate(self, _from: str, to: str) -> float:
+        pivot_rates = await self.get_pivot_rates()
+
+        def pivot_rate(currency: str) -> float:
+            if currency == self.pivot:
+                return 1.0
+
+            rate = pivot_rates.get(currency)
+            if not rate:
+                raise exceptions.CurrencyNotSupported(currency)
+
+            return rate
+
+        return pivot_rate(to) / pivot_rate(_from)
+
+    async def rate(self, _from: str, to: str) -> float:
+        # a currency converted to itself still has to be one we know, so
+        # there is no shortcut for it
+        if self.uses_direct_rate(_from):
+            return await self.direct_rate(_from, to)
+
+        return await self.cross_rate(_from, to)
+
+    async def rate_matrix(self, sources: List[str], targets: List[str]) -> np.ndarray:
+        """
+        Rates from every currency in `sources` (rows) to every currency
+        in `targets` (columns)
+        """
+        direct_sources = [
+            index for index, _from in enumerate(sources) if self.uses_direct_rate(_from)
+        ]
+        matrix = np.empty((len(sources), len(targets)), dtype=np.float64)
+
+        if len(direct_sources) < len(sources):
+            pivot_rates = await self.get_pivot_rates()
+
+            def pivot_vector(currencies: List[str]) -> np.ndarray:
+                vector = np.array(
+                    [
+                        1.0 if currency == self.pivot else pivot_rates.get(currency, 0.0)
+                        for currency in currencies
+                    ],
+                    dtype=np.float64,
+                )
+                unsupported = np.flatnonzero(vector == 0)
+                if unsupported.size:
+                    raise exceptions.CurrencyNotSupported(currencies[unsupported[0]])
+
+                return vector
+
+            # matrix[i, j] = pivot[targets[j]] / pivot[sources[i]]
+            source_rates = pivot_vector(sources)
+            target_rates = pivot_vector(targets)
+            matrix[:] = target_rates[np.newaxis, :] / source_rates[:, np.newaxis]
+
+        for index in direct_sources:
+            rates = await ConverterService.get_rate_table(
+                sources[index], self.redis_client
+            )
+            for column, to in enumerate(targets):
+                if to == sources[index]:
+                    matrix[index, column] = 1.0
+                elif to in rates:
+                    matrix[index, column] = rates[to]
+                else:
+                    raise exceptions.CurrencyNotSupported(to)
+
+        return matrix
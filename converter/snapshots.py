@@ -0,0 +1,87 @@
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import uuid4
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as upsert
+
+from backend.services import AsyncBaseService
+from backend.settings import settings
+
+from . import exceptions
+from .models import RateSnapshot
+
+
+class RateSnapshotService(AsyncBaseService):
+    """
+    Keeps a snapshot of the pivot rate table for every day, so
+    conversions can be made at the rates of a past day without going
+    upstream
+    """
+    # snapshots of days that are over, by base and day. They can't change
+    # so they are kept until they are the least recently used
+    past_snapshots: "OrderedDict[Tuple[str, date], Dict[str, float]]" = OrderedDict()
+
+    async def save_snapshot(
+        self, base: str, day: date, rates: Dict[str, float]
+    ) -> None:
+        """
+        Records the rates of `day`. They replace the ones recorded earlier
+        in the day, but a day that is over is left as it was
+        """
+        statement = upsert(RateSnapshot).values(
+            id=uuid4(), base=base, day=day, rates=rates
+        )
+        statement = statement.on_conflict_do_update(
+            constraint="uq_ratesnapshot_base_day",
+            set_={"rates": statement.excluded.rates},
+            where=RateSnapshot.day >= datetime.utcnow().date(),
+        )
+        await self.db.execute(statement)
+        await self.db.commit()
+
+    async def get_snapshot(self, base: str, day: date) -> Optional[Dict[str, float]]:
+        key = (base, day)
+        snapshots = self.past_snapshots
+
+        if key in snapshots:
+            snapshots.move_to_end(key)
+            return snapshots[key]
+
+        rates = (
+            await self.db.execute(
+                select(RateSnapshot.rates).where(
+                    RateSnapshot.base == base, RateSnapshot.day == day
+                )
+            )
+        ).scalar()
+
+        if rates is not None and day < datetime.utcnow().date():
+            snapshots[key] = rates
+            if len(snapshots) > settings.RATE_SNAPSHOT_CACHE_SIZE:
+                snapshots.popitem(last=False)
+
+        return rates
+
+    @staticmethod
+    def unsupported_currencies(
+        currencies: Iterable[str], pivot_rates: Dict[str, float]
+    ) -> List[str]:
+        """
+        Returns the currencies that can't be converted at the pivot rates
+        of a snapshot
+        """
+        return [
+            currency
+            for currency in currencies
+            if currency != settings.RATE_PIVOT_CURRENCY and currency not in pivot_rates
+        ]
+
+    async def get_pivot_rates(self, day: date) -> Dict[str, float]:
+        rates = await self.get_snapshot(settings.RATE_PIVOT_CURRENCY, day)
+
+        if rates is None:
+            raise exceptions.RateSnapshotNotFound(day)
+
+        return rates
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import random
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from redis import Redis
+from starlette.concurrency import run_in_threadpool
+
+from backend.cache import read_cache
+from backend.settings import settings
+from db.db import AsyncLocalSession, LocalSession
+
+from .partitions import HistoryPartitionService
+from .services import ConverterService, cache_refills
+from .snapshots import RateSnapshotService
+
+
+class CacheRefresher:
+    """
+    Refreshes the currency list and the rate tables in use before they go
+    stale, so no request has to wait on upstream for data we had recently.
+    If upstream is down the last good values keep being served until
+    CURRENCY_CACHE_STALE_TIME runs out. The pivot table is also saved as
+    the rate snapshot of the day.
+    """
+    def __init__(self, redis_client: Redis) -> None:
+        self.redis_client = redis_client
+        self.task: Optional[asyncio.Task] = None
+        # version of the pivot table last written as a snapshot
+        self.snapshot_version = -1
+
+    def start(self) -> None:
+        self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self) -> None:
+        if self.task is None:
+            return
+
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+        self.task = None
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                logging.exception("Refreshing the currency cache failed")
+
+            # jitter keeps the workers from refreshing in lockstep
+            jitter = random.uniform(
+                -settings.CACHE_REFRESH_JITTER, settings.CACHE_REFRESH_JITTER
+            )
+            await asyncio.sleep(settings.CACHE_REFRESH_INTERVAL * (1 + jitter))
+
+    def refills(self) -> Dict[str, Callable[[], Awaitable[Any]]]:
+        redis_client = self.redis_client
+        refills = {
+            ConverterService.CURRENCIES_REDIS_KEY: lambda: (
+                ConverterService.cache_currency_list(redis_client)
+            )
+        }
+
+        for base in ConverterService.hot_rate_tables():
+            refills[ConverterService.RATES_REDIS_KEY.format(base)] = (
+                lambda base=base: ConverterService.cache_rate_table(base, redis_client)
+            )
+
+        return refills
+
+    def read_unexpiring(self, key: str) -> Optional[Any]:
+        """
+        Returns the cached value unless it expires soon enough to need
+        a refresh
+        """
+        cached = read_cache(self.redis_client, key)
+
+        if cached is None or cached.expires_in < settings.CACHE_REFRESH_AHEAD:
+            return None
+
+        return cached.data
+
+    async def refresh(self) -> None:
+        for key, fill in self.refills().items():
+            if self.read_unexpiring(key) is not None:
+                continue
+
+            try:
+                await cache_refills.load(
+                    key,
+                    self.redis_client,
+                    read=lambda key=key: self.read_unexpiring(key),
+                    fill=fill,
+                )
+            except Exception:
+                # keep serving what we have and try the other keys
+                logging.exception("Could not refresh %s", key)
+
+        try:
+            await self.snapshot_rates()
+        except Exception:
+            logging.exception("Could not snapshot the rates")
+
+    async def snapshot_rates(self) -> None:
+        """
+        Records the pivot rate table as the snapshot of the day it was
+        fetched on, once for every new version of it
+        """
+        pivot = settings.RATE_PIVOT_CURRENCY
+        cached = read_cache(
+            self.redis_client, ConverterService.RATES_REDIS_KEY.format(pivot)
+        )
+
+        if cached is None or cached.version == self.snapshot_version:
+            return
+
+        fetched_at = cached.expires_at - settings.CURRENCY_CACHE_EXPIRY_TIME
+        day = datetime.utcfromtimestamp(fetched_at).date()
+
+        async with AsyncLocalSession() as db:
+            await RateSnapshotService(db).save_snapshot(pivot, day, cached.data)
+
+        self.snapshot_version = cached.version
+
+
+class PartitionMaintainer:
+    """
+    Keeps the monthly partitions of conversion history created ahead of
+    time and applies the retention policy to old ones, every
+    HISTORY_PARTITION_MAINTENANCE_INTERVAL seconds
+    """
+    def __init__(self) -> None:
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self) -> None:
+        if self.task is None:
+            return
+
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+        self.task = None
+
+    def maintain(self) -> None:
+        db = LocalSession()
+        try:
+            HistoryPartitionService(db).maintain()
+        finally:
+            db.close()
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await run_in_threadpool(self.maintain)
+            except Exception:
+                logging.exception("Maintaining the history partitions failed")
+
+            await asyncio.sleep(settings.HISTORY_PARTITION_MAINTENANCE_INTERVAL)
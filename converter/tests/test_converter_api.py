@@ -1,5 +1,8 @@
+import json
+
 from starlette.testclient import TestClient
 
+from backend.settings import settings
 from conftest import temp_db
 from main import app
 
@@ -87,6 +90,34 @@ def test_authenticated_user_can_convert_currency():
     assert "rate" in response.json()
     assert "result" in response.json()
 
+@temp_db
+def test_converting_as_of_a_day_without_rates_is_not_found():
+    response = client.post(
+        "/api/v1/user/signup",
+        json=user
+    )
+
+    assert response.status_code == 200
+
+    response = client.post(
+        "/api/v1/user/login",
+        data=credentials
+    )
+
+    assert response.status_code == 200
+
+    access_token = response.json()['access_token']
+    response = client.post(
+        "/api/v1/currencies/convert",
+        json={**payload, "as_of": "2000-01-01"},
+        headers={
+            'Authorization': f"Bearer {access_token}"
+        }
+    )
+
+    assert response.status_code == 404
+    assert response.json()['detail'] == "There are no rates for 2000-01-01"
+
 @temp_db
 def test_unauthenticated_user_cannot_convert_currency():
     access_token = 'access_token'
@@ -148,7 +179,7 @@ def test_history_can_be_seen_by_authenticated_user():
     )
 
     assert response.status_code == 200
-    assert len(response.json()) == 1
+    assert len(response.json()['results']) == 1
 
 @temp_db
 def test_history_cannot_be_seen_by_unauthenticated_user():
@@ -242,7 +273,7 @@ def test_history_can_be_filtered_by_from_currency():
     )
 
     assert response.status_code == 200
-    assert len(response.json()) == 3
+    assert len(response.json()['results']) == 3
 
 @temp_db
 def test_history_can_be_filtered_by_to_currency():
@@ -321,4 +352,345 @@ def test_history_can_be_filtered_by_to_currency():
     )
 
     assert response.status_code == 200
-    assert len(response.json()) == 2
+    assert len(response.json()['results']) == 2
+
+@temp_db
+def test_authenticated_user_can_convert_in_batch():
+    response = client.post(
+        "/api/v1/user/signup",
+        json=user
+    )
+
+    assert response.status_code == 200
+
+    response = client.post(
+        "/api/v1/user/login",
+        data=credentials
+    )
+
+    assert response.status_code == 200
+    assert "access_token" in response.json()
+
+    access_token = response.json()['access_token']
+    response = client.post(
+        "/api/v1/currencies/convert/batch",
+        json={"conversions": [payload, payload2, payload]},
+        headers={
+            'Authorization': f"Bearer {access_token}"
+        }
+    )
+
+    assert response.status_code == 200
+    conversions = response.json()["conversions"]
+    assert len(conversions) == 3
+    assert conversions[0] == conversions[2]
+    assert conversions[1]["to_currency"] == "jpy"
+    for conversion in conversions:
+        assert conversion["result"] == conversion["amount"] * conversion["rate"]
+
+    response = client.get(
+        "/api/v1/currencies/history",
+        headers={
+            'Authorization': f"Bearer {access_token}"
+        }
+    )
+
+    assert response.status_code == 200
+    assert len(response.json()['results']) == 3
+
+@temp_db
+def test_unauthenticated_user_cannot_convert_in_batch():
+    access_token = 'access_token'
+    response = client.post(
+        "/api/v1/currencies/convert/batch",
+        json={"conversions": [payload, payload2]},
+        headers={
+            'Authorization': f"Bearer {access_token}"
+        }
+    )
+
+    assert response.status_code == 403
+    assert "detail" in response.json()
+
+@temp_db
+def test_history_is_paginated_with_a_cursor():
+    response = client.post(
+        "/api/v1/user/signup",
+        json=user
+    )
+
+    assert response.status_code == 200
+
+    response = client.post(
+        "/api/v1/user/login",
+        data=credentials
+    )
+
+    assert response.status_code == 200
+
+    access_token = response.json()['access_token']
+    for body in (payload, payload2, payload):
+        response = client.post(
+            "/api/v1/currencies/convert",
+            json=body,
+            headers={
+                'Authorization': f"Bearer {access_token}"
+            }
+        )
+        assert response.status_code == 200
+
+    response = client.get(
+        "/api/v1/currencies/history?limit=2",
+        headers={
+            'Authorization': f"Bearer {access_token}"
+        }
+    )
+
+    assert response.status_code == 200
+    first_page = response.json()
+    assert len(first_page['results']) == 2
+    assert first_page['next_cursor']
+
+    response = client.get(
+        f"/api/v1/currencies/history?limit=2&cursor={first_page['next_cursor']}",
+        headers={
+            'Authorization': f"Bearer {access_token}"
+        }
+    )
+
+    assert response.status_code == 200
+    second_page = response.json()
+    assert len(second_page['results']) == 1
+    assert second_page['next_cursor'] is None
+
+    timestamps = [
+        item['timestamp']
+        for item in first_page['results'] + second_page['results']
+    ]
+    assert timestamps == sorted(timestamps, reverse=True)
+
+@temp_db
+def test_history_can_be_filtered_by_date_range():
+    response = client.post(
+        "/api/v1/user/signup",
+        json=user
+    )
+
+    assert response.status_code == 200
+
+    response = client.post(
+        "/api/v1/user/login",
+        data=credentials
+    )
+
+    assert response.status_code == 200
+
+    access_token = response.json()['access_token']
+    response = client.post(
+        "/api/v1/currencies/convert",
+        json=payload,
+        headers={
+            'Authorization': f"Bearer {access_token}"
+        }
+    )
+    assert response.status_code == 200
+
+    response = client.get(
+        "/api/v1/currencies/history?start=2000-01-01T00:00:00&end=2000-02-01T00:00:00",
+        headers={
+            'Authorization': f"Bearer {access_token}"
+        }
+    )
+
+    assert response.status_code == 200
+    assert len(response.json()['results']) == 0
+
+    response = client.get(
+        "/api/v1/currencies/history?start=2000-01-01T00:00:00",
+        headers={
+            'Authorization': f"Bearer {access_token}"
+        }
+    )
+
+    assert response.status_code == 200
+    assert len(response.json()['results']) == 1
+
+@temp_db
+def test_history_can_be_summarised_per_period():
+    response = client.post(
+        "/api/v1/user/signup",
+        json=user
+    )
+
+    assert response.status_code == 200
+
+    response = client.post(
+        "/api/v1/user/login",
+        data=credentials
+    )
+
+    assert response.status_code == 200
+
+    access_token = response.json()['access_token']
+    for body in (payload, payload2, payload):
+        response = client.post(
+            "/api/v1/currencies/convert",
+            json=body,
+            headers={
+                'Authorization': f"Bearer {access_token}"
+            }
+        )
+        assert response.status_code == 200
+
+    for granularity in ("day", "week", "month"):
+        response = client.get(
+            f"/api/v1/currencies/history/summary?granularity={granularity}",
+            headers={
+                'Authorization': f"Bearer {access_token}"
+            }
+        )
+
+        assert response.status_code == 200
+        summaries = {
+            summary['to_currency']: summary for summary in response.json()
+        }
+        assert len(summaries) == 2
+        assert summaries['ngn']['count'] == 2
+        assert summaries['ngn']['total_amount'] == payload['amount'] * 2
+        assert summaries['jpy']['count'] == 1
+
+    response = client.get(
+        "/api/v1/currencies/history/summary?granularity=year",
+        headers={
+            'Authorization': f"Bearer {access_token}"
+        }
+    )
+
+    assert response.status_code == 422
+
+@temp_db
+def test_history_rejects_an_invalid_cursor():
+    response = client.post(
+        "/api/v1/user/signup",
+        json=user
+    )
+
+    assert response.status_code == 200
+
+    response = client.post(
+        "/api/v1/user/login",
+        data=credentials
+    )
+
+    assert response.status_code == 200
+
+    access_token = response.json()['access_token']
+    response = client.get(
+        "/api/v1/currencies/history?cursor=notacursor",
+        headers={
+            'Authorization': f"Bearer {access_token}"
+        }
+    )
+
+    assert response.status_code == 400
+    assert response.json()['detail'] == "The cursor is invalid"
+
+@temp_db
+def test_history_can_be_exported_as_ndjson_and_csv():
+    response = client.post(
+        "/api/v1/user/signup",
+        json=user
+    )
+
+    assert response.status_code == 200
+
+    response = client.post(
+        "/api/v1/user/login",
+        data=credentials
+    )
+
+    assert response.status_code == 200
+
+    access_token = response.json()['access_token']
+    for body in (payload, payload2):
+        response = client.post(
+            "/api/v1/currencies/convert",
+            json=body,
+            headers={
+                'Authorization': f"Bearer {access_token}"
+            }
+        )
+        assert response.status_code == 200
+
+    response = client.get(
+        "/api/v1/currencies/history/export?format=ndjson&to_currency=ngn",
+        headers={
+            'Authorization': f"Bearer {access_token}"
+        }
+    )
+
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith("application/x-ndjson")
+    lines = response.text.splitlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0])['to_currency'] == "ngn"
+
+    response = client.get(
+        "/api/v1/currencies/history/export?format=csv",
+        headers={
+            'Authorization': f"Bearer {access_token}"
+        }
+    )
+
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith("text/csv")
+    lines = response.text.splitlines()
+    assert lines[0] == "timestamp,from_currency,to_currency,amount,rate,result"
+    assert len(lines) == 3
+
+@temp_db
+def test_a_batch_at_the_limit_is_converted_and_recorded():
+    response = client.post(
+        "/api/v1/user/signup",
+        json=user
+    )
+
+    assert response.status_code == 200
+
+    response = client.post(
+        "/api/v1/user/login",
+        data=credentials
+    )
+
+    assert response.status_code == 200
+
+    access_token = response.json()['access_token']
+    response = client.post(
+        "/api/v1/currencies/convert/batch",
+        json={"conversions": [payload] * settings.BATCH_CONVERSION_LIMIT},
+        headers={
+            'Authorization': f"Bearer {access_token}"
+        }
+    )
+
+    assert response.status_code == 200
+    assert len(response.json()["conversions"]) == settings.BATCH_CONVERSION_LIMIT
+
+    response = client.get(
+        "/api/v1/currencies/history/summary",
+        headers={
+            'Authorization': f"Bearer {access_token}"
+        }
+    )
+
+    assert response.status_code == 200
+    assert response.json()[0]['count'] == settings.BATCH_CONVERSION_LIMIT
+
+@temp_db
+def test_internal_stats_are_not_served_unless_enabled():
+    assert not settings.INTERNAL_STATS_ENABLED
+
+    for route in ("/api/v1/currencies/mirrors", "/api/v1/currencies/history/buffer"):
+        response = client.get(route)
+
+        assert response.status_code == 404
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+from fakeredis import FakeRedis
+
+from backend.cache import local_cache
+from backend.settings import settings
+from converter import services
+from converter.services import ConverterService
+
+CURRENCIES = {"usd": "US Dollar", "ngn": "Nigerian Naira"}
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    monkeypatch.setattr(
+        ConverterService, "currency_codes", (-1, frozenset(), 0.0)
+    )
+    monkeypatch.setattr(local_cache, "entries", {})
+    served = {"currencies": CURRENCIES, "requests": 0}
+
+    async def make_request(url):
+        served["requests"] += 1
+        return dict(served["currencies"])
+
+    monkeypatch.setattr(services, "make_request", make_request)
+    return served
+
+
+def unsupported(currencies, redis_client):
+    return asyncio.run(
+        ConverterService.unsupported_currencies(currencies, redis_client)
+    )
+
+
+def test_a_cold_index_is_filled_from_the_currency_list(upstream):
+    redis_client = FakeRedis()
+
+    assert unsupported(["usd", "xyz"], redis_client) == ["xyz"]
+    assert upstream["requests"] == 1
+    assert redis_client.exists(ConverterService.CURRENCY_CODES_REDIS_KEY)
+
+
+def test_recently_checked_codes_are_answered_from_memory(upstream):
+    redis_client = FakeRedis()
+    asyncio.run(ConverterService.cache_currency_list(redis_client))
+
+    assert unsupported(["ngn", "xyz"], redis_client) == ["xyz"]
+
+    # within LOCAL_CACHE_TTL Redis isn't asked again
+    redis_client.delete(ConverterService.CURRENCY_CODES_REDIS_KEY)
+    assert unsupported(["ngn", "xyz"], redis_client) == ["xyz"]
+    assert upstream["requests"] == 1
+
+
+def test_codes_are_reloaded_when_the_list_changes(upstream, monkeypatch):
+    monkeypatch.setattr(settings, "LOCAL_CACHE_TTL", 0)
+    redis_client = FakeRedis()
+    asyncio.run(ConverterService.cache_currency_list(redis_client))
+
+    assert unsupported(["jpy"], redis_client) == ["jpy"]
+    version, codes, _ = ConverterService.currency_codes
+    assert codes == set(CURRENCIES)
+
+    upstream["currencies"] = dict(CURRENCIES, jpy="Japanese Yen")
+    asyncio.run(ConverterService.cache_currency_list(redis_client))
+
+    assert unsupported(["jpy"], redis_client) == []
+    assert ConverterService.currency_codes[0] > version
+    assert ConverterService.currency_codes[1] == set(CURRENCIES) | {"jpy"}
@@ -0,0 +1,187 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+from sqlalchemy.dialects import postgresql
+
+from backend.settings import settings
+from converter.writer import (
+    HistoryWriter,
+    history_row,
+    insert_history,
+    summarize_history,
+)
+
+# most bind parameters Postgres takes in a single statement
+MAX_PARAMETERS = 32767
+
+USER_ID = uuid4()
+
+
+def rows(count, to_currency="ngn"):
+    return [
+        history_row(
+            {
+                "from_currency": "usd",
+                "to_currency": to_currency,
+                "amount": 30.0,
+                "rate": 750.0,
+                "result": 22500.0,
+                "user_id": USER_ID,
+            }
+        )
+        for _ in range(count)
+    ]
+
+
+def test_rows_are_stamped_and_summarised_in_utc():
+    row = rows(1)[0]
+
+    assert row["timestamp"].utcoffset() == timedelta(0)
+    assert summarize_history([row])[0]["day"] == datetime.now(timezone.utc).date()
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.rows = []
+        self.is_down = False
+        self.writes = 0
+
+    async def write(self, rows):
+        self.writes += 1
+        if self.is_down:
+            raise ConnectionError("database is down")
+        # like a code too long for the column, which fails the whole insert
+        if any(len(row["to_currency"]) > 12 for row in rows):
+            raise ValueError("value too long")
+        self.rows.extend(rows)
+
+
+def writer_with(database):
+    writer = HistoryWriter()
+    writer.write = database.write
+    return writer
+
+
+def test_a_bad_row_does_not_hold_up_the_others():
+    database = FakeDatabase()
+    writer = writer_with(database)
+    writer.queue.extend(rows(5) + rows(1, to_currency="x" * 40) + rows(5))
+
+    asyncio.run(writer.flush())
+
+    assert len(database.rows) == 10
+    assert writer.stats() == {
+        "depth": 0,
+        "written": 10,
+        "failed_flushes": 1,
+        "dead_lettered": 1,
+    }
+
+
+def test_rows_wait_for_the_database_to_come_back():
+    database = FakeDatabase()
+    database.is_down = True
+    writer = writer_with(database)
+    writer.queue.extend(rows(3))
+
+    asyncio.run(writer.flush())
+
+    # one try for the batch, and none for each of its rows
+    assert database.writes == 1
+    assert writer.depth == 3
+    assert writer.dead_lettered == 0
+
+    database.is_down = False
+    asyncio.run(writer.flush())
+
+    assert writer.depth == 0
+    assert len(database.rows) == 3
+
+
+def test_rows_left_when_the_database_goes_away_are_kept():
+    database = FakeDatabase()
+    writer = writer_with(database)
+    writer.queue.extend(rows(2) + rows(1, to_currency="x" * 40) + rows(2))
+
+    async def write_then_go_down(rows):
+        if database.writes == 3:
+            database.is_down = True
+        await FakeDatabase.write(database, rows)
+
+    writer.write = write_then_go_down
+    asyncio.run(writer.flush())
+
+    # the batch was rejected for the bad row, and two rows went in one by
+    # one before the database went away. The rest wait for it
+    assert len(database.rows) == 2
+    assert writer.depth == 3
+    assert writer.dead_lettered == 0
+
+
+def test_conversions_are_not_queued_past_the_limit(monkeypatch):
+    monkeypatch.setattr(settings, "HISTORY_QUEUE_LIMIT", 4)
+    writer = writer_with(FakeDatabase())
+
+    async def enqueue():
+        writer.start()
+        try:
+            return writer.enqueue(rows(3)), writer.enqueue(rows(3))
+        finally:
+            writer.task.cancel()
+
+    assert asyncio.run(enqueue()) == (True, False)
+    assert writer.depth == 3
+    # nothing is queued while the writer isn't running
+    assert not HistoryWriter().enqueue(rows(1))
+
+
+def test_rows_left_on_stop_are_dead_lettered():
+    database = FakeDatabase()
+    writer = writer_with(database)
+
+    async def run_while_database_is_down():
+        writer.start()
+        writer.enqueue(rows(2))
+        database.is_down = True
+        await writer.stop()
+
+    asyncio.run(run_while_database_is_down())
+
+    assert writer.depth == 0
+    assert writer.dead_lettered == 2
+    assert not database.rows
+
+
+class RecordingSession:
+    def __init__(self):
+        self.statements = []
+        self.committed = False
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+
+    async def commit(self):
+        self.committed = True
+
+
+def test_a_full_batch_is_written_within_the_parameter_limit():
+    session = RecordingSession()
+    batch = rows(settings.BATCH_CONVERSION_LIMIT)
+    # a user each, so there are as many summaries as conversions
+    for row in batch:
+        row["user_id"] = uuid4()
+
+    asyncio.run(insert_history(session, batch))
+
+    written = {"conversionhistory": 0, "conversionsummary": 0}
+    for statement in session.statements:
+        parameters = statement.compile(dialect=postgresql.dialect()).params
+        assert len(parameters) <= MAX_PARAMETERS
+        written[statement.table.name] += len(parameters) // len(statement.table.columns)
+
+    assert written == {
+        "conversionhistory": settings.BATCH_CONVERSION_LIMIT,
+        "conversionsummary": settings.BATCH_CONVERSION_LIMIT,
+    }
+    assert session.committed
@@ -0,0 +1,79 @@
+import asyncio
+import gc
+
+from fakeredis import FakeRedis
+
+from backend.settings import settings
+from converter import services
+from converter.services import MirrorPool
+
+HUNG_MIRROR = "https://hung.example/{}.json"
+FAST_MIRROR = "https://fast.example/{}.json"
+BROKEN_MIRROR = "https://broken.example/{}.json"
+
+
+def test_a_hung_mirror_sinks_in_the_ranking(monkeypatch):
+    monkeypatch.setattr(settings, "UPSTREAM_HEDGE_DELAY", 0.02)
+
+    async def make_request(url):
+        if url.startswith("https://hung.example"):
+            await asyncio.sleep(60)
+        # slower than the hedge delay, so the hung mirror is always raced
+        await asyncio.sleep(0.05)
+        return {"usd": {"ngn": 1.0}}
+
+    monkeypatch.setattr(services, "make_request", make_request)
+    pool = MirrorPool([HUNG_MIRROR, FAST_MIRROR])
+    redis_client = FakeRedis()
+
+    async def requests():
+        fastest = []
+        for _ in range(10):
+            response = await pool.request(redis_client, "usd")
+            assert response == {"usd": {"ngn": 1.0}}
+            fastest.append(pool.ranked()[0])
+        return fastest
+
+    fastest = asyncio.run(requests())
+
+    assert set(fastest) == {FAST_MIRROR}
+    assert pool.latencies[HUNG_MIRROR] > pool.latencies[FAST_MIRROR]
+    assert pool.successes[HUNG_MIRROR] == 0
+
+
+def test_mirrors_failing_alongside_the_winner_are_charged(monkeypatch):
+    monkeypatch.setattr(settings, "UPSTREAM_HEDGE_DELAY", 0.01)
+    monkeypatch.setattr(settings, "CIRCUIT_BREAKER_MIN_CALLS", 1000)
+    races = 20
+
+    async def requests():
+        unretrieved = []
+        asyncio.get_running_loop().set_exception_handler(
+            lambda loop, context: unretrieved.append(context)
+        )
+        answered = asyncio.Event()
+
+        async def make_request(url):
+            # the hedge fails just as the first mirror answers, so both
+            # are done by the time the race is looked at
+            if url.startswith("https://broken.example"):
+                answered.set()
+                raise RuntimeError("mirror broke")
+            await answered.wait()
+            return {"usd": {"ngn": 1.0}}
+
+        monkeypatch.setattr(services, "make_request", make_request)
+        pool = MirrorPool([FAST_MIRROR, BROKEN_MIRROR])
+        redis_client = FakeRedis()
+
+        for _ in range(races):
+            answered.clear()
+            assert await pool.request(redis_client, "usd") == {"usd": {"ngn": 1.0}}
+
+        gc.collect()
+        return pool, unretrieved
+
+    pool, unretrieved = asyncio.run(requests())
+
+    assert pool.failures[BROKEN_MIRROR] == races
+    assert not unretrieved
@@ -0,0 +1,89 @@
+from datetime import date
+
+from converter.partitions import HistoryPartitionService, month_start
+
+
+class FakeSession:
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, statement, *args):
+        self.statements.append(str(statement))
+
+
+def service_with(partitions):
+    service = HistoryPartitionService(FakeSession())
+    service.partitions = lambda: {
+        month: service.partition_name(month) for month in partitions
+    }
+    return service
+
+
+def test_month_start_moves_across_month_and_year_boundaries():
+    assert month_start(date(2023, 5, 17)) == date(2023, 5, 1)
+    assert month_start(date(2023, 1, 31), 1) == date(2023, 2, 1)
+    assert month_start(date(2023, 11, 30), 2) == date(2024, 1, 1)
+    assert month_start(date(2023, 12, 31), 1) == date(2024, 1, 1)
+    assert month_start(date(2024, 1, 1), -1) == date(2023, 12, 1)
+    assert month_start(date(2024, 3, 31), -15) == date(2022, 12, 1)
+    assert month_start(date(2023, 6, 15), 24) == date(2025, 6, 1)
+
+
+def test_partition_names_hold_the_year_and_month():
+    service = service_with([])
+
+    assert service.partition_name(date(2024, 1, 1)) == "conversionhistory_y2024m01"
+    assert service.partition_name(date(2023, 12, 1)) == "conversionhistory_y2023m12"
+
+
+def test_partitions_are_created_ahead_into_the_next_year():
+    service = service_with([date(2023, 11, 1)])
+
+    created = service.create_partitions(date(2023, 11, 20), months_ahead=3)
+
+    assert created == [
+        "conversionhistory_y2023m12",
+        "conversionhistory_y2024m01",
+        "conversionhistory_y2024m02",
+    ]
+    statements = service.db.statements
+    assert len(statements) == 3
+    assert "FROM ('2023-12-01 00:00:00+00') TO ('2024-01-01 00:00:00+00')" in statements[0]
+    assert "FROM ('2024-01-01 00:00:00+00') TO ('2024-02-01 00:00:00+00')" in statements[1]
+
+
+def test_partitions_that_exist_are_not_created_again():
+    service = service_with([date(2024, 1, 1), date(2024, 2, 1)])
+
+    assert service.create_partitions(date(2024, 1, 5), months_ahead=1) == []
+    assert service.db.statements == []
+
+
+def test_partitions_past_retention_are_detached_and_dropped():
+    service = service_with(
+        [date(2023, 10, 1), date(2023, 11, 1), date(2023, 12, 1), date(2024, 1, 1)]
+    )
+
+    removed = service.apply_retention(date(2024, 1, 15), months=2, drop=True)
+
+    assert removed == ["conversionhistory_y2023m10"]
+    assert service.db.statements == [
+        'ALTER TABLE "conversionhistory" DETACH PARTITION "conversionhistory_y2023m10"',
+        'DROP TABLE "conversionhistory_y2023m10"',
+    ]
+
+
+def test_partitions_past_retention_are_only_detached_without_drop():
+    service = service_with([date(2022, 12, 1), date(2023, 1, 1), date(2023, 2, 1)])
+
+    removed = service.apply_retention(date(2023, 2, 1), months=1, drop=False)
+
+    assert removed == ["conversionhistory_y2022m12"]
+    assert all("DROP" not in statement for statement in service.db.statements)
+
+
+def test_history_is_kept_forever_without_retention():
+    service = service_with([date(2000, 1, 1)])
+
+    assert service.apply_retention(date(2024, 1, 1), months=0, drop=True) == []
+    assert service.db.statements == []
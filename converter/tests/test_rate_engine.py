@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+from fakeredis import FakeRedis
+from fastapi import HTTPException
+
+from converter.services import RateEngine
+from converter.snapshots import RateSnapshotService
+
+PIVOT_RATES = {"ngn": 750.0, "jpy": 150.0}
+BOGUS_CURRENCY = "x" * 40
+
+
+def engine():
+    return RateEngine(FakeRedis(), pivot="usd", pivot_rates=PIVOT_RATES)
+
+
+def test_cross_rates_are_worked_out_from_the_pivot():
+    assert asyncio.run(engine().rate("usd", "ngn")) == 750.0
+    assert asyncio.run(engine().rate("jpy", "ngn")) == 5.0
+    assert asyncio.run(engine().rate("ngn", "usd")) == 1 / 750.0
+
+
+def test_known_currencies_convert_to_themselves_at_one():
+    assert asyncio.run(engine().rate("ngn", "ngn")) == 1.0
+    assert asyncio.run(engine().rate("usd", "usd")) == 1.0
+
+
+def test_an_unknown_currency_is_not_converted_to_itself():
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(engine().rate(BOGUS_CURRENCY, BOGUS_CURRENCY))
+
+    assert error.value.status_code == 400
+
+    with pytest.raises(HTTPException):
+        asyncio.run(engine().rate_matrix([BOGUS_CURRENCY], [BOGUS_CURRENCY]))
+
+
+def test_snapshots_only_convert_the_pivot_and_their_own_currencies():
+    assert RateSnapshotService.unsupported_currencies(
+        ["usd", "ngn", BOGUS_CURRENCY], PIVOT_RATES
+    ) == [BOGUS_CURRENCY]
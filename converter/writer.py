@@ -0,0 +1,275 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+from sqlalchemy import exc, insert
+from sqlalchemy.dialects.postgresql import insert as upsert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.settings import settings
+from db.db import AsyncLocalSession
+
+from .models import ConversionHistory, ConversionSummary
+
+
+def history_row(values: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    A row of history stamped with its id and the time of the conversion
+    rather than the time it eventually gets written. The time is in UTC,
+    as are summary days and partitions. asyncpg would take a naive one
+    for local time
+    """
+    return dict(values, id=uuid4(), timestamp=datetime.now(timezone.utc))
+
+
+def summarize_history(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Adds rows of history up into totals per user, day and pair. They are
+    sorted so concurrent upserts lock the summaries in the same order
+    """
+    totals: Dict[tuple, Dict[str, Any]] = {}
+
+    for row in rows:
+        key = (
+            row["user_id"],
+            row["timestamp"].date(),
+            row["from_currency"],
+            row["to_currency"],
+        )
+        total = totals.setdefault(
+            key, {"count": 0, "total_amount": 0.0, "total_result": 0.0}
+        )
+        total["count"] += 1
+        total["total_amount"] += row["amount"]
+        total["total_result"] += row["result"]
+
+    summaries = []
+    for key in sorted(totals):
+        user_id, day, from_currency, to_currency = key
+        summaries.append(
+            dict(
+                totals[key],
+                id=uuid4(),
+                user_id=user_id,
+                day=day,
+                from_currency=from_currency,
+                to_currency=to_currency,
+            )
+        )
+
+    return summaries
+
+
+def chunks(rows: List[Dict[str, Any]]) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Splits rows into chunks of up to HISTORY_FLUSH_SIZE. A statement may
+    only have 32767 parameters, which a multi-row insert of a whole batch
+    of conversions goes over
+    """
+    for start in range(0, len(rows), settings.HISTORY_FLUSH_SIZE):
+        yield rows[start:start + settings.HISTORY_FLUSH_SIZE]
+
+
+async def upsert_summaries(db: AsyncSession, rows: List[Dict[str, Any]]) -> None:
+    """
+    Adds rows of history to the summaries of their day, with an upsert
+    per chunk of summaries
+    """
+    for summaries in chunks(summarize_history(rows)):
+        statement = upsert(ConversionSummary).values(summaries)
+        statement = statement.on_conflict_do_update(
+            constraint="uq_conversionsummary_user_day_pair",
+            set_={
+                column: getattr(ConversionSummary, column) + statement.excluded[column]
+                for column in ("count", "total_amount", "total_result")
+            },
+        )
+        await db.execute(statement)
+
+
+async def insert_history(db: AsyncSession, rows: List[Dict[str, Any]]) -> None:
+    """
+    Writes rows of history with a multi-row insert per chunk, and their
+    totals to the summaries, all in the same transaction
+    """
+    for chunk in chunks(rows):
+        await db.execute(insert(ConversionHistory).values(chunk))
+    await upsert_summaries(db, rows)
+    await db.commit()
+
+
+def database_is_down(error: Exception) -> bool:
+    """
+    Whether an error means the database couldn't be reached or gave up on
+    the connection, rather than that it rejected the rows
+    """
+    if isinstance(error, exc.DBAPIError) and error.connection_invalidated:
+        return True
+
+    return isinstance(
+        error,
+        (
+            OSError,
+            asyncio.TimeoutError,
+            exc.TimeoutError,
+            exc.InterfaceError,
+            exc.OperationalError,
+        ),
+    )
+
+
+class HistoryWriter:
+    """
+    Write-behind buffer for conversion history. Conversions are queued in
+    memory and written as multi-row inserts once HISTORY_FLUSH_SIZE of them
+    are waiting or every HISTORY_FLUSH_INTERVAL seconds, so a conversion
+    doesn't wait on a Postgres commit. What is queued is flushed on shutdown.
+
+    A batch the database rejects is written again row by row so one bad
+    row doesn't hold up the rest. The rows it rejects are dead-lettered:
+    logged in full and counted rather than dropped silently. So is what is
+    still queued when the worker stops. While the database can't be
+    reached, batches wait in the queue for the next flush instead.
+    """
+    def __init__(self) -> None:
+        self.queue: List[Dict[str, Any]] = []
+        self.task: Optional[asyncio.Task] = None
+        self.wake_up: Optional[asyncio.Event] = None
+        self.written = 0
+        self.failed_flushes = 0
+        self.dead_lettered = 0
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None
+
+    @property
+    def depth(self) -> int:
+        return len(self.queue)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "depth": self.depth,
+            "written": self.written,
+            "failed_flushes": self.failed_flushes,
+            "dead_lettered": self.dead_lettered,
+        }
+
+    def start(self) -> None:
+        self.wake_up = asyncio.Event()
+        self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self) -> None:
+        if self.task is None:
+            return
+
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+        self.task = None
+        await self.flush()
+
+        # the worker is going away, so what couldn't be written is
+        # logged for whoever has to put it back
+        if self.queue:
+            self.dead_letter(self.queue, "the worker stopped")
+            self.queue = []
+
+    def enqueue(self, rows: List[Dict[str, Any]]) -> bool:
+        """
+        Queues rows to be written. Returns False when the writer isn't
+        running or the queue is full, in which case the caller has to
+        write them itself
+        """
+        if not self.running:
+            return False
+
+        if self.depth + len(rows) > settings.HISTORY_QUEUE_LIMIT:
+            logging.warning(
+                "History queue is full, writing %s conversions directly", len(rows)
+            )
+            return False
+
+        self.queue.extend(rows)
+
+        if self.depth >= settings.HISTORY_FLUSH_SIZE:
+            self.wake_up.set()
+
+        return True
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self.wake_up.wait(), timeout=settings.HISTORY_FLUSH_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                pass
+
+            self.wake_up.clear()
+            await self.flush()
+
+    async def write(self, rows: List[Dict[str, Any]]) -> None:
+        async with AsyncLocalSession() as db:
+            await insert_history(db, rows)
+
+    def dead_letter(self, rows: List[Dict[str, Any]], reason: str) -> None:
+        self.dead_lettered += len(rows)
+        for row in rows:
+            logging.error("Dead-lettered conversion (%s): %r", reason, row)
+
+    async def write_row_by_row(
+        self, rows: List[Dict[str, Any]]
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Writes rows one at a time. Returns the ones that were rejected and
+        the ones left unwritten because the database went away
+        """
+        rejected = []
+
+        for index, row in enumerate(rows):
+            try:
+                await self.write([row])
+            except Exception as error:
+                if database_is_down(error):
+                    return rejected, rows[index:]
+                rejected.append(row)
+            else:
+                self.written += 1
+
+        return rejected, []
+
+    async def flush(self) -> None:
+        while self.queue:
+            rows = self.queue[:settings.HISTORY_FLUSH_SIZE]
+            del self.queue[:len(rows)]
+
+            try:
+                await self.write(rows)
+            except Exception as error:
+                self.failed_flushes += 1
+                logging.exception("Could not write %s conversions", len(rows))
+                unwritten = rows if database_is_down(error) else []
+            else:
+                self.written += len(rows)
+                continue
+
+            if not unwritten:
+                rejected, unwritten = await self.write_row_by_row(rows)
+                if rejected:
+                    self.dead_letter(rejected, "the row was rejected")
+
+            if unwritten:
+                # the database is down. Trying each row would only wait on
+                # it more, so they are tried again on the next flush, behind
+                # the rows queued since so they can't hold those up
+                self.queue.extend(unwritten)
+                return
+
+
+history_writer = HistoryWriter()
@@ -1,42 +1,138 @@
+import asyncio
 import logging
+import time
 
 import redis
 import sqlalchemy
-from databases import Database
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy_utils import database_exists, create_database
 
 from backend.settings import settings
 
 
-db = Database(settings.DB_URL)
+POOL_OPTIONS = {
+    "pool_size": settings.DB_POOL_SIZE,
+    "max_overflow": settings.DB_MAX_OVERFLOW,
+    "pool_timeout": settings.DB_POOL_TIMEOUT,
+    "pool_recycle": settings.DB_POOL_RECYCLE,
+    "pool_pre_ping": settings.DB_POOL_PRE_PING,
+}
+
 metadata = sqlalchemy.MetaData()
-engine = sqlalchemy.create_engine(settings.DB_URL, pool_size=3, max_overflow=0)
+engine = sqlalchemy.create_engine(settings.DB_URL, **POOL_OPTIONS)
 if not database_exists(engine.url):
     create_database(engine.url)
 
 LocalSession = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# requests go through the asyncio engine so waiting on Postgres doesn't
+# block the event loop. The sync engine is left for migrations and
+# maintenance that runs in a thread
+async_engine = create_async_engine(settings.ASYNC_DB_URL, **POOL_OPTIONS)
+AsyncLocalSession = sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    # rows are still read after the commit, and reloading them would
+    # need another round trip
+    expire_on_commit=False,
+)
+
+# reads that can do with being a little behind the primary go to the
+# replica. Without one they stay on the primary
+async_read_engine = (
+    create_async_engine(settings.ASYNC_DB_REPLICA_URL, **POOL_OPTIONS)
+    if settings.ASYNC_DB_REPLICA_URL
+    else None
+)
+# when the replica last couldn't be reached
+replica_failed_at = float("-inf")
+
+
+class ReplicaSession(AsyncSession):
+    """
+    Session on the read replica. Like any session it connects on its first
+    query, so a request that never queries holds no connection. If the
+    replica can't be reached then, the query and the rest of the session
+    go to the primary, as do new sessions for DB_REPLICA_RETRY_INTERVAL
+    """
+    async def execute(self, *args, **kwargs):
+        return await self.on_replica_or_primary(super().execute, *args, **kwargs)
+
+    async def stream(self, *args, **kwargs):
+        return await self.on_replica_or_primary(super().stream, *args, **kwargs)
+
+    async def on_replica_or_primary(self, query, *args, **kwargs):
+        global replica_failed_at
+
+        # only the first query connects
+        if self.bind is async_engine or self.in_transaction():
+            return await query(*args, **kwargs)
+
+        try:
+            return await query(*args, **kwargs)
+        except (OSError, asyncio.TimeoutError, InterfaceError, OperationalError):
+            logging.exception("Read replica is unreachable, reading from primary")
+            replica_failed_at = time.monotonic()
+
+        await self.rollback()
+        self.bind = async_engine
+        self.sync_session.bind = async_engine.sync_engine
+        return await query(*args, **kwargs)
+
+
+AsyncReadSession = sessionmaker(
+    bind=async_read_engine or async_engine,
+    class_=ReplicaSession,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
 metadata.create_all(engine)
 
 
-def get_db():
+async def get_async_db():
     """
-    A dependency for working with PostgreSQL
+    A dependency for working with PostgreSQL without blocking the event loop
     """
-    try:
-        db = LocalSession()
+    async with AsyncLocalSession() as db:
         yield db
-    except Exception as e:
-        logging.error(e)
-    finally:
-        db.close()
 
-def get_redis():
+
+async def get_async_read_db():
+    """
+    A dependency for reads that can be served by the read replica. Falls
+    back to the primary when there is no replica or it can't be reached
+    (see ReplicaSession). The replica may be behind, so a read that comes
+    up empty for a row that was just written should be tried again on the
+    primary
+    """
+    replica_is_up = (
+        time.monotonic() - replica_failed_at > settings.DB_REPLICA_RETRY_INTERVAL
+    )
+    Session = AsyncReadSession if replica_is_up else AsyncLocalSession
+
+    async with Session() as db:
+        yield db
+
+
+# one pool for the whole worker so requests reuse connections instead of
+# opening one each. Keys are namespaced with backend.settings.redis_key
+redis_pool = redis.ConnectionPool.from_url(
+    settings.REDIS_URL,
+    max_connections=settings.REDIS_MAX_CONNECTIONS,
+    socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+    health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+)
+redis_client = redis.Redis(connection_pool=redis_pool)
+
+
+def get_redis() -> redis.Redis:
     """
     A dependecy for working with Redis for easy testing and overrides
     """
-    RedisClient = redis.Redis.from_url(settings.REDIS_URL, db=0)
-    yield RedisClient
-    RedisClient.flushdb()
+    return redis_client
     
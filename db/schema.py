@@ -5,5 +5,9 @@ from pydantic import BaseModel
 
 
 class BaseSchema(BaseModel):
+    class Config:
+        # lets schemas be built straight from models with from_orm
+        orm_mode = True
+
     def to_dict(self) -> Any:
         return jsonable_encoder(self)
@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend.settings import settings
+from db import db
+from db.db import ReplicaSession, get_async_read_db
+
+replica = create_async_engine("postgresql+asyncpg://replica/currency")
+
+
+def test_reads_move_to_the_primary_while_the_replica_is_down(monkeypatch):
+    monkeypatch.setattr(db, "replica_failed_at", float("-inf"))
+    monkeypatch.setattr(
+        db, "AsyncReadSession", sessionmaker(bind=replica, class_=ReplicaSession)
+    )
+    replica_is_down = True
+    queried = []
+
+    async def execute(session, statement, *args, **kwargs):
+        queried.append(session.bind)
+        if session.bind is replica and replica_is_down:
+            raise ConnectionRefusedError("replica is down")
+        return session.bind
+
+    monkeypatch.setattr(AsyncSession, "execute", execute)
+
+    async def read():
+        async for session in get_async_read_db():
+            return await session.execute(select(1))
+
+    assert asyncio.run(read()) is db.async_engine
+    assert queried == [replica, db.async_engine]
+
+    # within the retry interval the replica isn't tried
+    queried.clear()
+    assert asyncio.run(read()) is db.async_engine
+    assert queried == [db.async_engine]
+
+    # and past it, it is
+    queried.clear()
+    replica_is_down = False
+    db.replica_failed_at = time.monotonic() - settings.DB_REPLICA_RETRY_INTERVAL - 1
+    assert asyncio.run(read()) is replica
+    assert queried == [replica]
+
+
+def test_a_read_session_connects_only_when_queried(monkeypatch):
+    monkeypatch.setattr(db, "replica_failed_at", float("-inf"))
+    monkeypatch.setattr(
+        db, "AsyncReadSession", sessionmaker(bind=replica, class_=ReplicaSession)
+    )
+    connected = []
+    monkeypatch.setattr(replica.sync_engine, "connect", lambda: connected.append(1))
+
+    async def open_session():
+        async for session in get_async_read_db():
+            return session
+
+    session = asyncio.run(open_session())
+
+    assert session.bind is replica
+    assert not session.in_transaction()
+    assert not connected
@@ -3,14 +3,19 @@ import logging
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import ORJSONResponse, RedirectResponse
 
+from auth.hasher import password_hasher
+from backend.http import close_http_client, start_http_client
+from backend.rate_limit import RateLimitHeadersMiddleware
 from backend.routes import router
 from backend.settings import settings
-from db.db import db
+from converter.tasks import CacheRefresher, PartitionMaintainer
+from converter.writer import history_writer
+from db.db import async_engine, async_read_engine, redis_client, redis_pool
 
 
-app = FastAPI(title=settings.APP_TITLE)
+app = FastAPI(title=settings.APP_TITLE, default_response_class=ORJSONResponse)
 
 app.include_router(router, prefix="/api/v1")
 
@@ -21,6 +26,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"]
 )
+app.add_middleware(RateLimitHeadersMiddleware)
 
 @app.get("/")
 async def home():
@@ -32,12 +38,27 @@ async def home():
 
 @app.on_event("startup")
 async def startup():
-    await db.connect()
+    await start_http_client()
+    app.state.cache_refresher = CacheRefresher(redis_client)
+    app.state.cache_refresher.start()
+    app.state.partition_maintainer = PartitionMaintainer()
+    app.state.partition_maintainer.start()
+    if settings.HISTORY_WRITE_BEHIND:
+        history_writer.start()
 
 
 @app.on_event("shutdown")
 async def shutdown():
-    await db.disconnect()
+    await app.state.cache_refresher.stop()
+    await app.state.partition_maintainer.stop()
+    # write out whatever is still queued before the worker goes away
+    await history_writer.stop()
+    await async_engine.dispose()
+    if async_read_engine is not None:
+        await async_read_engine.dispose()
+    await close_http_client()
+    redis_pool.disconnect()
+    password_hasher.shutdown()
 
 
 # if __name__ == "__main__":